@@ -7,12 +7,21 @@
 # Imports
 
 import csv
+import gc
 import os
 import sys
 import numpy as np
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 import utils
+import onf
+import history
+import rv_screening
+import checkpoint
+from instrumentation import Instrumentation
+import result_cache
 
 # --------------------------------------------------------------------#
 # List of elements to write specific sensitivities if running in verbose mode
@@ -20,62 +29,228 @@ elements = []  # leave empty to write all dDRESPdDVdRV
 
 
 # --------------------------------------------------------------------#
-def get_covariance(list_RV, verbose):
-    """Set up of covarinace matrix. Edit non-diagonal parameters for correlated RVs"""
-    r = np.identity(len(list_RV))
-
-    # edit symmetric entries corresponding to problem formulation
-    # r[0, 1] = 0.5
-    # r[1, 0] = r[0, 1]
-    # r[0, 3] = 0.5
-    # r[3, 0] = r[0, 3]
-    # r[1, 2] = 0.5
-    # r[2, 1] = r[1, 2]
-    # r[2, 3] = 0.5
-    # r[3, 2] = r[3, 2]
-
-    cov = r.copy()
-    for i, RV_i in enumerate(list_RV):
-        for j, RV_j in enumerate(list_RV):
-            cov[i, j] *= RV_i.sigma * RV_j.sigma
+def get_correlation(number_of_rv, correlation=None):
+    """Set up of correlation matrix from correlation_rv in config_rdo.py. Options:
+    None:                                       uncorrelated RVs
+    dense matrix (nested list or array):        full correlation matrix
+    {"pairs": [(i, j, rho), ...]}:              correlation of pairs of RVs (0-based), symmetric
+    {"kernel": "exponential"/"gaussian",        correlation by distance of RV coordinates,
+     "coordinates": [...], "length": l}:        exp(-d/l) or exp(-(d/l)^2)
+    """
+    if correlation is None:
+        return np.identity(number_of_rv)
+
+    if isinstance(correlation, dict) and "pairs" in correlation:
+        r = np.identity(number_of_rv)
+        pairs = np.asarray(correlation["pairs"], dtype=float).reshape(-1, 3)
+        i, j = pairs[:, 0].astype(int), pairs[:, 1].astype(int)
+        r[i, j] = pairs[:, 2]
+        r[j, i] = pairs[:, 2]
+    elif isinstance(correlation, dict) and "kernel" in correlation:
+        coordinates = np.asarray(correlation["coordinates"], dtype=float).reshape(number_of_rv, -1)
+        distance = np.sqrt(((coordinates[:, None, :] - coordinates[None, :, :]) ** 2).sum(axis=-1))
+        distance /= float(correlation["length"])
+        if correlation["kernel"] == "exponential":
+            r = np.exp(-distance)
+        elif correlation["kernel"] == "gaussian":
+            r = np.exp(-(distance**2))
+        else:
+            raise ValueError("Unknown correlation kernel %s!" % correlation["kernel"])
+    else:
+        r = np.array(correlation, dtype=float)
+
+    if r.shape != (number_of_rv, number_of_rv):
+        raise ValueError("Correlation matrix must be of shape ({0}, {0}).".format(number_of_rv))
+    if not np.allclose(r, r.T):
+        raise ValueError("Correlation matrix must be symmetric.")
+    return r
+
+
+_covariance_cache = {}  # last covariance, reused across cycles in a long-lived process
+
+
+def get_covariance(list_RV, verbose, correlation=None):
+    """Set up of covarinace matrix. Pass correlation as defined in get_correlation() for correlated RVs"""
+    r = get_correlation(len(list_RV), correlation)
+    sigma = np.asarray([RV.sigma for RV in list_RV], dtype=float)
+    key = (r.tobytes(), sigma.tobytes())
+    cov = _covariance_cache.get(key)
+    if cov is None:
+        cov = Covariance(r * np.outer(sigma, sigma))
+        _covariance_cache.clear()
+        _covariance_cache[key] = cov
     if verbose:
         print("Correlation matrix: ")
         print(r)
         print("Covariance matrix: ")
-        print(cov)
+        print(cov.matrix)
 
     return cov
 
 
-def get_results(tosca_dirs, verbose):
-    """Open optimization_status_*.csv for every finite difference step and read restults."""
-    resultsDRESP = []
-    resultsSENS = []
+def get_variance_weights(cov):
+    """Weight matrix W for the FOSM-variance var = dRV^T * W * dRV.
+    For uncorrelated RVs, W holds the variances on its diagonal. For correlated RVs,
+    the upper triangle of the covariance matrix is used, i.e. every pair (i, j>=i)
+    contributes once.
+    """
+    if isinstance(cov, Covariance):
+        return cov.weights
+    cov = np.asarray(cov, dtype=float)
+    if np.any(cov != np.diag(np.diag(cov))):
+        return np.triu(cov)
+    return np.diag(np.diag(cov))
+
+
+def report_exception(future):
+    """Print exception of output written in the background, which would be lost otherwise."""
+    if future.exception() is not None:
+        print("Writing output in the background failed: {}".format(future.exception()))
+        sys.stdout.flush()
+
+
+def report_remove_error(function, path, exc_info):
+    """Print files which could not be removed, e.g. memory-mapped files still open on Windows."""
+    print("Removing {} failed: {}".format(path, exc_info[1]))
+    sys.stdout.flush()
+
+
+def get_sensitivity_block_name(dresp_name):
+    """Name of the block holding the sensitivities of a DRESP in TP_SENS_000.onf."""
+    if "[OBJ_FUNC]" in dresp_name:
+        return "OBJ_FUNC_SENSITIVITY"
+    elif "[CON]" in dresp_name:
+        return "CONSTRAINT_SENSITIVITY_" + dresp_name[5:]
+    else:
+        raise TypeError("Unknown scheme for DRESP name %s!" % dresp_name)
+
+
+def get_difference_operators(list_RV, number_of_runs):
+    """Finite difference operators as matrices of shape (RVs x runs).
+    Multiplying the results of all runs (values or sensitivities) with the operators
+    yields the first and second-order derivatives w.r.t. all RVs at once.
+    RVs with delta = 0 have zero rows and thus zero derivatives.
+    """
+    D = np.zeros((len(list_RV), number_of_runs))
+    DD = np.zeros((len(list_RV), number_of_runs))
+    for RV in list_RV:
+        if RV.delta == 0:
+            continue
+        if not RV.use_central_differences:
+            D[RV.idx, RV.forward_step] += 1 / RV.delta
+            D[RV.idx, 0] -= 1 / RV.delta
+        else:
+            D[RV.idx, RV.forward_step] += 1 / (2 * RV.delta)
+            D[RV.idx, RV.backward_step] -= 1 / (2 * RV.delta)
+            DD[RV.idx, RV.forward_step] += 1 / (RV.delta**2)
+            DD[RV.idx, 0] -= 2 / (RV.delta**2)
+            DD[RV.idx, RV.backward_step] += 1 / (RV.delta**2)
+    return D, DD
+
+
+def read_status(file, chunk_size=4096):
+    """Read header row and last row of optimization_status*.csv.
+    The last row is found by seeking backwards from the end of the file, so the
+    file is never read in full.
+    """
+    with open(file, "rb") as f:
+        header = f.readline()
+        header_end = f.tell()
+        end = f.seek(0, 2)
+        tail = b""
+        position = end
+        while position > header_end:
+            position = max(header_end, position - chunk_size)
+            f.seek(position)
+            tail = f.read(end - position)
+            if tail.strip(b"\r\n").count(b"\n") > 0:
+                break
+    rows = [header.decode()]
+    lines = tail.strip(b"\r\n").splitlines()
+    if lines and lines[-1].strip():
+        rows.append(lines[-1].decode())
+    return list(csv.reader(rows, delimiter=","))
+
+
+def remove_run_files(result_dir, sens_file):
+    """Remove sensitivity file and Tosca directory of finite difference run."""
+    if os.path.exists(sens_file):
+        os.remove(sens_file)
+    tosca_dir = [
+        os.path.join(result_dir, d) for d in os.listdir(result_dir) if os.path.isdir(os.path.join(result_dir, d))
+    ]
+    if tosca_dir and os.path.exists(tosca_dir[0]):
+        shutil.rmtree(tosca_dir[0])
+
+
+def read_run_status(result_dir):
+    """Read header and DRESP values of a single finite difference run."""
+    results_files = glob(os.path.join(result_dir, checkpoint.STATUS_PATTERN))
+    results_files.sort()
+    resultsDRESP = [[], []]
+    for file in results_files:
+        listResultsDRESP = read_status(file)
+        for row in range(len(listResultsDRESP)):
+            resultsDRESP[row].extend(listResultsDRESP[row])
+    return resultsDRESP
+
+
+def read_run(result_dir):
+    """Read DRESP values and sensitivities of a single finite difference run."""
+    resultsDRESP = read_run_status(result_dir)
+    resultsSENS = onf.read_sensitivities(os.path.join(result_dir, "TP_SENS_000.onf"))
+    return resultsDRESP, resultsSENS
+
+
+def read_dresp_names(tosca_dirs, stream=None, cache=None):
+    """Names of the DRESPs without VOL and MASS of the first run in tosca_dirs, read
+    before evaluate() writes any output."""
+    if stream is not None and stream.value is not None:
+        return stream.names  # first run already read
+    result_dirs = sorted(glob(os.path.join(tosca_dirs, "run_*")))
+    if not result_dirs:
+        return []
+    key = result_cache.read_key(result_dirs[0]) if cache is not None else None
+    results = cache.get(key) if key is not None else None
+    status = results[0] if results is not None else read_run_status(result_dirs[0])
+    return [name for name in utils.read_names(status) if "VOL" not in name if "MASS" not in name]
+
+
+def get_results(tosca_dirs, verbose, number_of_workers=1, cache=None):
+    """Open optimization_status_*.csv for every finite difference step and read restults.
+    Run directories are read concurrently by number_of_workers threads. If not verbose,
+    files of the runs are removed by a background thread after reading.
+    With a result cache, runs are taken from the cache if their key is known and
+    results read from disk are added to the cache.
+    """
     result_dirs = glob(os.path.join(tosca_dirs, "run_*"))
     result_dirs.sort()
-    for result_dir in result_dirs:
-        results_files = glob(os.path.join(result_dir, "optimization_status*.csv"))
-        results_files.sort()
-        sens_file = os.path.join(result_dir, "TP_SENS_000.onf")
-        resultsDRESP.append([[], [], []])
-        for file in results_files:
-            with open(file, "r") as resultsfileDRESP:
-                listResultsDRESP = list(csv.reader(resultsfileDRESP, delimiter=","))
-                for row in range(len(listResultsDRESP)):
-                    resultsDRESP[-1][row].extend(listResultsDRESP[row])
-        resultsSENS.append([])
-        with open(sens_file, "r") as resultsfileSENS:
-            for line in resultsfileSENS:
-                resultsSENS[-1].append(line)
+
+    keys = [result_cache.read_key(result_dir) if cache is not None else None for result_dir in result_dirs]
+    cleaner = ThreadPoolExecutor(max_workers=1)
+
+    def ingest(num):
+        result_dir, key = result_dirs[num], keys[num]
+        results = cache.get(key) if cache is not None else None
+        if results is None:
+            results = read_run(result_dir)
+            if key is not None:
+                cache.put(key, *results)
         if not verbose:
-            os.remove(sens_file)
-            tosca_dir = [
-                os.path.join(result_dir, d)
-                for d in os.listdir(result_dir)
-                if os.path.isdir(os.path.join(result_dir, d))
-            ]
-            if tosca_dir and os.path.exists(tosca_dir[0]):
-                shutil.rmtree(tosca_dir[0])
+            cleaner.submit(remove_run_files, result_dir, os.path.join(result_dir, "TP_SENS_000.onf"))
+        return results
+
+    # runs sharing a key are read only once
+    unique = [num for num, key in enumerate(keys) if key is None or key not in keys[:num]]
+    with ThreadPoolExecutor(max_workers=max(1, int(number_of_workers))) as executor:
+        results = dict(zip(unique, executor.map(ingest, unique)))
+    cleaner.shutdown(wait=False)
+    for num, key in enumerate(keys):
+        if num not in results:
+            results[num] = results[keys.index(key)]
+
+    resultsDRESP = [results[num][0] for num in range(len(result_dirs))]
+    resultsSENS = [results[num][1] for num in range(len(result_dirs))]
     return resultsDRESP, resultsSENS
 
 
@@ -129,6 +304,17 @@ class Dresp(object):
         self.ddRV = []
         self.dRVdDV = []
         self.dRVidRVj = []
+        self.dRV_direction = None  # directional derivatives if using eigen directions
+        self.dv_index = None  # indices of active DVs if arrays over DVs are sparse, see DrespBatch
+
+    def expand(self, values):
+        """Return array over active DVs in the full layout of all DVs, inactive DVs are zero."""
+        if self.dv_index is None:
+            return values
+        values = np.asarray(values)
+        full = np.zeros(values.shape[:-1] + (self.numberOfDV,), dtype=values.dtype)
+        full[..., self.dv_index] = values
+        return full
 
     def find_values(self, results):
         """Find value of DRESP in data extracted from optimization_status_all.csv as list.
@@ -142,28 +328,17 @@ class Dresp(object):
                     self.value.append(float(result[-1][coloumn]))
 
     def find_sensitivities(self, results):
-        """Find sensitivities of DRESP in data extracted from TP_SENS_000.onf as list.
-        Input:  results:   list with content of all TP_SENS_000.onf
-                           results[i] is result file TP_SENS_000_i.onf
+        """Find sensitivities of DRESP in data extracted from TP_SENS_000.onf.
+        Input:  results:   list with sensitivity blocks of all TP_SENS_000.onf
+                           results[i] is dict of blocks in result file TP_SENS_000_i.onf
         """
-        if "[OBJ_FUNC]" in self.name:
-            name = "OBJ_FUNC_SENSITIVITY"
-        elif "[CON]" in self.name:
-            name = "CONSTRAINT_SENSITIVITY_" + self.name[5:]
-        else:
-            raise TypeError("Unknown scheme for DRESP name %s!" % self.name)
+        name = get_sensitivity_block_name(self.name)
 
-        # extract number of DV
-        lineOfDRESP = [ln for ln, line in enumerate(results[0]) if name in line]
-        lineOfDRESP = int(lineOfDRESP[0])
-        if self.numberOfDV == None:
-            self.numberOfDV = int(results[0][lineOfDRESP + 1])
-
-        # extract sensitivities dDRESP/dDV from full lines in file
+        # extract sensitivities dDRESP/dDV from blocks
         for result in results:
-            TP_SENS_list = result[(lineOfDRESP + 2) : (lineOfDRESP + 2 + self.numberOfDV)]
-            TP_SENS_rows_split = [row.split(",") for row in TP_SENS_list[:][:]]
-            self.dDV.append(np.asarray(TP_SENS_rows_split, dtype=float)[:, 1])
+            self.dDV.append(onf.find_block(result, name))
+        if self.numberOfDV == None:
+            self.numberOfDV = len(self.dDV[0])
 
     def calculate_partial_derivatives(self):
         self.__calculate_dRV()
@@ -223,27 +398,27 @@ class Dresp(object):
                 self.ddRV.append(0)
         return self.ddRV
 
-    def calculate_objective(self, cov, kappa):
-        """Calculate mean, sigma, objective and its derivative of DRESP."""
-        var = 0
-        dvar_dDV = [0]
+    def calculate_objective(self, cov, kappa, weights=None):
+        """Calculate mean, sigma, objective and its derivative of DRESP.
+        The FOSM-variance is evaluated as quadratic form dRV^T * W * dRV with the
+        weight matrix W from get_variance_weights(). Pass cov as Covariance object
+        or precomputed weights to avoid checking the covariance for every DRESP.
+        """
+        if weights is None:
+            weights = get_variance_weights(cov)
 
         self.mean = self.value[0]  # DRESP at mean of RVs
         self.dmean_dDV = self.dDV[0]
 
-        for i in [RV.idx for RV in self.list_RV]:
-            # Correlated random variables
-            if not np.allclose(cov * np.linalg.inv(cov), np.identity(cov.shape[0])):
-                for j in [RV.idx for RV in self.list_RV if RV.idx >= i]:
-                    # j loop for considering correlation in fosm-variance
-                    var_loop = (self.dRV[i] * self.dRV[j]) * cov[i][j]
-                    dvar_loop = 2 * (np.multiply(self.dRVdDV[i], self.dRV[j]) * cov[i][j])
-                    var += var_loop
-                    dvar_dDV += dvar_loop
-            else:
-                # default: uncorrelated random variables
-                var += (self.dRV[i] ** 2) * cov[i][i]
-                dvar_dDV += 2 * self.dRV[i] * self.dRVdDV[i] * cov[i][i]
+        if len(self.dRV):
+            dRV = np.asarray(self.dRV, dtype=float)
+            dRVdDV = np.asarray(self.dRVdDV, dtype=float)
+            W_dRV = weights.dot(dRV)
+            var = dRV.dot(W_dRV)
+            dvar_dDV = 2 * W_dRV.dot(dRVdDV)
+        else:
+            var = 0
+            dvar_dDV = np.zeros(1)
 
         self.sigma = np.sqrt(var)
         if var > 0:
@@ -255,13 +430,25 @@ class Dresp(object):
         self.objective = self.mean + kappa * self.sigma
         self.dObjective_dDV = self.dmean_dDV + kappa * self.dsigma_dDV
 
-    def write_output(self, dst, elements=[], use_central_differences=True, verbose=False):
+    def write_output(
+        self, dst, elements=[], use_central_differences=True, verbose=False, writer=None, write_elements=None
+    ):
         """Write output of current cycle to Isight-work directory and parent Tosca work directory.
             Output to be written:
         DRESP_<name>.ONF:        DRESP value and sensitivities for parent optimization
-        DRESP_<name>_status.csv: Table with status of all cycles for DRESP"""
+        DRESP_<name>_status.csv: Table with status of all cycles for DRESP
+        If an executor is passed as writer, the debug output is written in the background.
+        Sensitivities per element are added to the debug output if write_elements, default: verbose."""
+        if write_elements is None:
+            write_elements = verbose
         self.__write_ONF(dst, verbose)
-        self.__write_sensitivities(dst, elements, use_central_differences, verbose)
+        if writer is not None:
+            future = writer.submit(
+                self.__write_sensitivities, dst, elements, use_central_differences, write_elements
+            )
+            future.add_done_callback(report_exception)
+        else:
+            self.__write_sensitivities(dst, elements, use_central_differences, write_elements)
 
     def __write_ONF(self, dst, verbose):
         """Write approximation of DRESP and its sensitivities to ONF file to be used in subsequent optimization."""
@@ -271,8 +458,7 @@ class Dresp(object):
             f.write("1, {:E}\n   -1\n".format(self.objective))
             f.write("# Data block 642 - Optimization Results - Elemental scalar value\n   -1\n   642\n")
             f.write("{:d}\n".format(self.numberOfDV))
-            for num, entry in enumerate(self.dObjective_dDV):
-                f.write("{:d}, {:07E}\n".format(num + 1, entry))
+            utils.write_rows(f, "%d, %07E\n", [np.arange(1, self.numberOfDV + 1), self.expand(self.dObjective_dDV)])
             f.write("   -1")
         if verbose:
             print("Saved output file {}".format(file))
@@ -282,6 +468,7 @@ class Dresp(object):
         writing only der. if dresp, mean and sigma w.r.t. DV.
         """
         sens_file = os.path.join(dst, "dresp_sensitivities_{}.csv".format(self.name))
+        dRV = self.dRV if self.dRV_direction is None else self.dRV_direction
 
         with open(sens_file, "w") as f:
             if use_central_differences == False:
@@ -295,7 +482,7 @@ class Dresp(object):
                 )
                 data_line = ",{},{},{}, ,{}".format(self.objective, self.mean, self.sigma, self.value[0])
                 for RV in self.list_RV:
-                    data_line += ", ,{},{}".format(self.value[RV.idx + 1], self.dRV[RV.idx])
+                    data_line += ", ,{},{}".format(self.value[RV.idx + 1], dRV[RV.idx])
                 data_line += "\n\n"
                 f.write(data_line)
             elif use_central_differences == True:
@@ -312,34 +499,24 @@ class Dresp(object):
                     data_line += ", ,{},{},{}".format(
                         self.value[2 * RV.idx + 1],
                         self.value[2 * RV.idx + 2],
-                        self.dRV[RV.idx],
+                        dRV[RV.idx],
                     )
                 f.write(data_line)
 
         if verbose:
             with open(sens_file, "a") as f:
                 f.write("\n\ne, ddresp, dmean, dsig\n")
-                data_line = "{},{},{},{}\n"
                 if len(elements) > 0:
-                    for e in elements:
-                        f.write(
-                            data_line.format(
-                                e,
-                                self.dObjective_dDV[e - 1],
-                                self.dmean_dDV[e - 1],
-                                self.dsigma_dDV[e - 1],
-                            )
-                        )
+                    ids = np.asarray(elements, dtype=int)
                 else:
-                    for e in range(self.numberOfDV):
-                        f.write(
-                            data_line.format(
-                                e + 1,
-                                self.dObjective_dDV[e],
-                                self.dmean_dDV[e],
-                                self.dsigma_dDV[e],
-                            )
-                        )
+                    ids = np.arange(1, self.numberOfDV + 1)
+                columns = [
+                    ids,
+                    np.asarray(self.expand(self.dObjective_dDV))[ids - 1],
+                    np.asarray(self.expand(self.dmean_dDV))[ids - 1],
+                    np.asarray(self.expand(self.dsigma_dDV))[ids - 1],
+                ]
+                utils.write_rows(f, "%s,%s,%s,%s\n", columns)
 
     def write_raw(self, dst):
         """Write out content read from tosca/abaqus for debugging purposes."""
@@ -350,10 +527,661 @@ class Dresp(object):
             f.write(header + "\n")
             data_placeholder = ", {}" * runs + "\n"
             f.write("ELEMENT" + data_placeholder.format(*self.value))
-            data_placeholder = "{}" + data_placeholder
-            for idx in range(len(self.dDV[0])):
-                dDVs = [dDV[idx] for dDV in self.dDV]
-                f.write(data_placeholder.format(idx + 1, *dDVs))
+            dDV = [self.expand(values) for values in self.dDV]
+            ids = np.arange(1, len(dDV[0]) + 1)
+            utils.write_rows(f, "%s" + ", %s" * runs + "\n", [ids] + dDV)
+
+
+class DrespBatch(object):
+    """Batched evaluation of all DRESPs of a job. Values are held as array of shape
+    (runs x DRESPs), sensitivities as array of shape (runs x DRESPs x DVs), so that
+    derivatives and robust objectives of all DRESPs are computed in a few vectorized
+    passes. The DV axis may be split into chunks processed by several threads.
+    Arrays over DVs may be stored compactly (e.g. dtype=np.float32) and memory-mapped
+    in storage_dir, derived quantities are computed in place in chunks of at most
+    chunk_size DVs, so the peak memory of a cycle is bounded.
+    With active_dvs, only the DVs in this index array are kept, e.g. without frozen
+    elements, or "auto" for all DVs with non-zero sensitivity of any DRESP in any run.
+    Sensitivities of other DVs are zero and only added for output.
+    """
+
+    accumulated = False  # dRVdDV accumulated while reading runs, see DrespStream
+
+    def __init__(
+        self,
+        names,
+        list_RV,
+        number_of_workers=1,
+        directions=None,
+        dtype=float,
+        storage_dir=None,
+        chunk_size=None,
+        active_dvs=None,
+    ):
+        self.names = list(names)
+        self.list_RV = list_RV
+        self.directions = directions
+        self.number_of_workers = max(1, int(number_of_workers))
+        self.numberOfDV = None
+        self.dtype = np.dtype(dtype)
+        self.storage_dir = storage_dir
+        self.chunk_size = chunk_size
+        self.active_dvs = active_dvs
+        self.dv_index = None  # None if all DVs are active
+
+        self.value = None
+        self.dDV = None
+        self.dRV = None
+        self.ddRV = None
+        self.dRVdDV = None
+        self.dRV_direction = None
+
+        self.mean = None
+        self.sigma = None
+        self.objective = None
+        self.dmean_dDV = None
+        self.dsigma_dDV = None
+        self.dObjective_dDV = None
+
+    def allocate(self, name, shape):
+        """Allocate array over DVs in memory or as memory-mapped file name.npy in storage_dir."""
+        if self.storage_dir is None:
+            return np.zeros(shape, dtype=self.dtype)
+        if not os.path.exists(self.storage_dir):
+            os.makedirs(self.storage_dir)
+        return np.lib.format.open_memmap(
+            os.path.join(self.storage_dir, name + ".npy"), mode="w+", dtype=self.dtype, shape=shape
+        )
+
+    def release(self):
+        """Drop all memory-mapped arrays, so their files are closed once no Dresp holds
+        views on them and storage_dir can be removed."""
+        for name, value in list(vars(self).items()):
+            if isinstance(value, np.memmap):
+                value.flush()
+                setattr(self, name, None)
+
+    def set_active_dvs(self, results, block_names):
+        """Set index of active DVs from active_dvs, detected from the sensitivity blocks of
+        all results for "auto"."""
+        if self.active_dvs is None:
+            dv_index = None
+        elif isinstance(self.active_dvs, str):
+            active = np.zeros(self.numberOfDV, dtype=bool)
+            for result in results:
+                for block_name in block_names:
+                    active |= onf.find_block(result, block_name) != 0
+            dv_index = np.flatnonzero(active)
+        else:
+            dv_index = np.unique(np.asarray(self.active_dvs, dtype=int))
+            if dv_index.size and (dv_index[0] < 0 or dv_index[-1] >= self.numberOfDV):
+                raise ValueError("Active DVs exceed number of DVs {:d}.".format(self.numberOfDV))
+        if dv_index is not None and len(dv_index) == self.numberOfDV:
+            dv_index = None  # all DVs active, keep dense layout
+        self.dv_index = dv_index
+
+    def select(self, values):
+        """Entries of active DVs of an array over all DVs."""
+        return values if self.dv_index is None else values[self.dv_index]
+
+    @property
+    def numberOfActiveDV(self):
+        return self.numberOfDV if self.dv_index is None else len(self.dv_index)
+
+    def find_values(self, results):
+        """Find values of all DRESPs in data extracted from optimization_status_all.csv.
+        Input:  results:   list with content of all optimization_status_all.csv
+        """
+        header = results[0][0]
+        columns = []
+        for name in self.names:
+            column = [c for c, entry in enumerate(header) if name in entry]
+            if not column:
+                raise ValueError("DRESP %s not found in optimization status." % name)
+            columns.append(column[0])
+        self.value = np.asarray([[float(result[-1][c]) for c in columns] for result in results])
+
+    def find_sensitivities(self, results):
+        """Find sensitivities of all DRESPs in data extracted from TP_SENS_000.onf.
+        Input:  results:   list with sensitivity blocks of all TP_SENS_000.onf
+        """
+        block_names = [get_sensitivity_block_name(name) for name in self.names]
+        if self.numberOfDV is None:
+            self.numberOfDV = len(onf.find_block(results[0], block_names[0]))
+        self.set_active_dvs(results, block_names)
+
+        self.dDV = self.allocate("dDV", (len(results), len(self.names), self.numberOfActiveDV))
+        for r, result in enumerate(results):
+            for d, block_name in enumerate(block_names):
+                self.dDV[r, d] = self.select(onf.find_block(result, block_name))
+
+    def calculate(self, cov, kappa, weights=None):
+        """Calculate partial derivatives w.r.t. RVs, mean, sigma and robust objective
+        including derivatives w.r.t. DVs for all DRESPs."""
+        if len(self.list_RV) > 0 and self.value.shape[0] <= 1:
+            raise ValueError("Missing results from finite difference steps.")
+        if weights is None:
+            weights = get_variance_weights(cov)
+
+        D, DD = get_difference_operators(self.list_RV, self.value.shape[0])
+        if self.directions is not None:
+            self.dRV_direction = D.dot(self.value)
+            D = self.directions.vectors.dot(D)  # derivatives w.r.t. RVs from directions
+        self.dRV = D.dot(self.value)  # RVs x DRESPs
+        if self.directions is not None:
+            self.directions.restore(self.names, self.dRV)
+        self.ddRV = DD.dot(self.value)
+        W_dRV = weights.dot(self.dRV)
+        var = np.einsum("id,id->d", self.dRV, W_dRV)
+
+        self.mean = self.value[0]
+        self.sigma = np.sqrt(var)
+        self.objective = self.mean + kappa * self.sigma
+        with np.errstate(divide="ignore"):
+            dsigma_scale = np.where(var > 0, 1 / (2.0 * self.sigma), 0.0)
+
+        if not self.accumulated:
+            self.dRVdDV = self.allocate("dRVdDV", (D.shape[0],) + self.dDV.shape[1:])
+        self.dsigma_dDV = self.allocate("dsigma_dDV", self.dDV.shape[1:])
+        self.dObjective_dDV = self.allocate("dObjective_dDV", self.dDV.shape[1:])
+        self.dmean_dDV = self.dDV[0]
+
+        def process_chunk(chunk):
+            # derived quantities are written in place, temporary arrays are of chunk size
+            if not self.accumulated:
+                self.dRVdDV[:, :, chunk] = np.tensordot(D, self.dDV[:, :, chunk], axes=1)
+            if self.directions is not None:
+                dvs = chunk if self.dv_index is None else self.dv_index[chunk]
+                self.directions.restore(self.names, None, self.dRVdDV[:, :, chunk], dvs)
+            dsigma_dDV = self.dsigma_dDV[:, chunk]
+            np.einsum("id,idk->dk", W_dRV, self.dRVdDV[:, :, chunk], out=dsigma_dDV, casting="same_kind")
+            dsigma_dDV *= (2 * dsigma_scale)[:, None]
+            np.multiply(dsigma_dDV, kappa, out=self.dObjective_dDV[:, chunk], casting="same_kind")
+            self.dObjective_dDV[:, chunk] += self.dmean_dDV[:, chunk]
+
+        number_of_chunks = self.number_of_workers
+        if self.chunk_size:
+            number_of_chunks = max(number_of_chunks, -(-self.numberOfActiveDV // int(self.chunk_size)))
+        chunks = [
+            slice(c[0], c[-1] + 1)
+            for c in np.array_split(np.arange(self.numberOfActiveDV), number_of_chunks)
+            if len(c) > 0
+        ]
+        if len(chunks) > 1 and self.number_of_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(len(chunks), self.number_of_workers)) as executor:
+                list(executor.map(process_chunk, chunks))
+        else:
+            for chunk in chunks:
+                process_chunk(chunk)
+
+    def to_dresps(self):
+        """Return Dresp objects holding views on the batched results, e.g. for output."""
+        list_DRESP = []
+        for d, name in enumerate(self.names):
+            dresp = Dresp(name, self.list_RV)
+            dresp.numberOfDV = self.numberOfDV
+            dresp.dv_index = self.dv_index
+            dresp.value = list(self.value[:, d])
+            dresp.dDV = list(self.dDV[:, d])
+            dresp.dRV = list(self.dRV[:, d])
+            dresp.dRVdDV = list(self.dRVdDV[:, d])
+            if self.directions is not None:
+                dresp.dRV_direction = list(self.dRV_direction[:, d])
+            if self.list_RV and self.list_RV[0].use_central_differences:
+                dresp.ddRV = list(self.ddRV[:, d])
+            dresp.mean = self.mean[d]
+            dresp.dmean_dDV = self.dmean_dDV[d]
+            dresp.sigma = self.sigma[d]
+            dresp.dsigma_dDV = self.dsigma_dDV[d]
+            dresp.cv = dresp.sigma / dresp.mean
+            dresp.objective = self.objective[d]
+            dresp.dObjective_dDV = self.dObjective_dDV[d]
+            list_DRESP.append(dresp)
+        return list_DRESP
+
+
+class DrespStream(DrespBatch):
+    """Batched evaluation of all DRESPs reading every finite difference run as soon as
+    it is complete, e.g. from the completion callback of an executor. As finite
+    differences are linear in the runs, the contribution of each run to dRVdDV is
+    accumulated on the fly, so only the sensitivities of the mean run have to be kept.
+    Runs not passed while solving (e.g. taken from the result cache) are read by finish().
+    Active DVs have to be given as index array, as "auto" requires all runs at once.
+    """
+
+    accumulated = True
+
+    def __init__(
+        self,
+        run_dirs,
+        list_RV,
+        number_of_workers=1,
+        directions=None,
+        cache=None,
+        verbose=False,
+        dtype=float,
+        storage_dir=None,
+        chunk_size=None,
+        active_dvs=None,
+    ):
+        if isinstance(active_dvs, str):
+            active_dvs = None  # all DVs are kept
+        DrespBatch.__init__(
+            self, [], list_RV, number_of_workers, directions, dtype, storage_dir, chunk_size, active_dvs
+        )
+        self.run_dirs = list(run_dirs)
+        self.cache = cache
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.ingested = {}  # run -> cache key
+        self.cleaner = ThreadPoolExecutor(max_workers=1)
+
+        D, _ = get_difference_operators(list_RV, len(self.run_dirs))
+        if directions is not None:
+            D = directions.vectors.dot(D)
+        self.operator = D
+
+    def add_result(self, result):
+        """Completion callback for executors, reads the run if successful."""
+        if result.success:
+            self.ingest(result.run)
+
+    def _read(self, run):
+        run_dir = self.run_dirs[run]
+        key = result_cache.read_key(run_dir) if self.cache is not None else None
+        results = self.cache.get(key) if key is not None else None
+        if results is None:
+            results = read_run(run_dir)
+            if key is not None:
+                self.cache.put(key, *results)
+        if not self.verbose:
+            self.cleaner.submit(remove_run_files, run_dir, os.path.join(run_dir, "TP_SENS_000.onf"))
+        return key, results
+
+    def _setup(self, status, sensitivities):
+        """Allocate arrays on arrival of the first run."""
+        self.names = [name for name in utils.read_names(status) if "VOL" not in name if "MASS" not in name]
+        self.block_names = [get_sensitivity_block_name(name) for name in self.names]
+        self.numberOfDV = len(onf.find_block(sensitivities, self.block_names[0]))
+        self.set_active_dvs([sensitivities], self.block_names)
+        shape = (len(self.names), self.numberOfActiveDV)
+        self.value = np.full((len(self.run_dirs), len(self.names)), np.nan)
+        self.dRVdDV = self.allocate("dRVdDV", (self.operator.shape[0],) + shape)
+        self.dDV = self.allocate("dDV", ((len(self.run_dirs) if self.verbose else 1),) + shape)
+
+    def ingest(self, run, key=None, results=None):
+        """Read run and add its contribution to values and accumulated derivatives."""
+        if results is None:
+            key, results = self._read(run)
+        status, sensitivities = results
+        sens = None
+        with self.lock:
+            if self.value is None:
+                self._setup(status, sensitivities)
+            header = status[0]
+            for d, name in enumerate(self.names):
+                column = [c for c, entry in enumerate(header) if name in entry][0]
+                self.value[run, d] = float(status[-1][column])
+
+            weights = self.operator[:, run]
+            if np.any(weights != 0) or run == 0 or self.verbose:
+                sens = np.stack([self.select(onf.find_block(sensitivities, block)) for block in self.block_names])
+            if sens is not None and np.any(weights != 0):
+                for i in np.flatnonzero(weights):
+                    self.dRVdDV[i] += weights[i] * sens
+            if run == 0:
+                self.dDV[0] = sens
+            elif self.verbose:
+                self.dDV[run] = sens
+            self.ingested[run] = key
+
+    def finish(self):
+        """Read all runs which have not been ingested while solving."""
+        for run in range(len(self.run_dirs)):
+            if run in self.ingested:
+                continue
+            key = result_cache.read_key(self.run_dirs[run]) if self.cache is not None else None
+            same = [other for other, other_key in self.ingested.items() if key is not None and other_key == key]
+            if same and not np.any(self.operator[:, run] != 0) and not self.verbose:
+                # identical RV values as ingested run (delta = 0), no contribution to derivatives
+                with self.lock:
+                    self.value[run] = self.value[same[0]]
+                    self.ingested[run] = key
+            else:
+                self.ingest(run, *self._read(run))
+        self.cleaner.shutdown(wait=False)
+        if self.verbose:
+            print("Read {:d} finite difference runs.".format(len(self.ingested)))
+
+
+class Covariance(object):
+    """Covariance matrix of RVs, checked once per run. Holds the weights for the
+    FOSM-variance and the eigen decomposition of correlated RVs, so the matrix does
+    not have to be checked again per DRESP. The matrix has to be positive
+    semi-definite; eigenvalues slightly below zero by round-off relative to the
+    largest eigenvalue (tolerance), e.g. for smooth Gaussian kernels, are clipped.
+    """
+
+    def __init__(self, matrix, tolerance=1e-8):
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.correlated = bool(np.any(self.matrix != np.diag(np.diag(self.matrix))))
+        if self.correlated:
+            values, vectors = np.linalg.eigh(self.matrix)
+        else:
+            values, vectors = np.diag(self.matrix), None
+        if values.size and values.min() < -tolerance * max(values.max(), 0.0):
+            raise ValueError("Covariance matrix of RVs is not positive semi-definite.")
+        if self.correlated and values.min() < 0:
+            values = np.clip(values, 0, None)
+            self.matrix = (vectors * values).dot(vectors.T)
+            self.matrix = (self.matrix + self.matrix.T) / 2
+        if self.correlated:
+            self.weights = np.triu(self.matrix)
+            order = np.argsort(values)[::-1]
+            values, vectors = values[order], vectors[:, order]
+            signs = np.sign(vectors[np.argmax(np.abs(vectors), axis=0), np.arange(vectors.shape[1])])
+            self._eigen = (values, vectors * signs)
+        else:
+            self.weights = np.diag(np.diag(self.matrix))
+
+    def eigen(self):
+        """Eigenvalues in descending order and eigenvectors (columns) of the covariance,
+        computed once. Signs are normalized so that the largest entry of each vector is positive.
+        """
+        if getattr(self, "_eigen", None) is None:
+            values, vectors = np.linalg.eigh(self.matrix)  # uncorrelated RVs, decomposed on demand
+            order = np.argsort(values)[::-1]
+            values, vectors = values[order], vectors[:, order]
+            signs = np.sign(vectors[np.argmax(np.abs(vectors), axis=0), np.arange(vectors.shape[1])])
+            self._eigen = (values, vectors * signs)
+        return self._eigen
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __getitem__(self, key):
+        return self.matrix[key]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.matrix if dtype is None else self.matrix.astype(dtype)
+
+
+class EigenDirections(object):
+    """Finite differences along the leading eigenvectors of the covariance instead of
+    along every RV. Directions are kept until variance_fraction of the total variance
+    is covered or the number of runs reaches max_runs. The step along direction k is
+    step * sqrt(lambda_k). Derivatives w.r.t. the RVs are rebuilt from the directional
+    derivatives g as dRV = V * g, with V holding the directions as columns.
+    """
+
+    def __init__(self, cov, use_central_differences, variance_fraction=1.0, max_runs=None, step=1.0):
+        values, vectors = cov.eigen()
+        values = np.clip(values, 0, None)
+        cumulative = np.cumsum(values) / np.sum(values)
+        number_of_directions = int(np.searchsorted(cumulative, variance_fraction - 1e-12) + 1)
+        if max_runs is not None:
+            runs_per_direction = 2 if use_central_differences else 1
+            number_of_directions = min(number_of_directions, max(1, (int(max_runs) - 1) // runs_per_direction))
+        number_of_directions = min(number_of_directions, len(values))
+
+        self.values = values[:number_of_directions]
+        self.vectors = vectors[:, :number_of_directions]
+        self.variance_fraction = cumulative[number_of_directions - 1]
+        self.steps = step * np.sqrt(self.values)
+        self.list_direction = [
+            RV(k, 0, np.sqrt(self.values[k]), self.steps[k], use_central_differences)
+            for k in range(number_of_directions)
+        ]
+
+    def __len__(self):
+        return len(self.list_direction)
+
+    def get_rv_values(self, mean_rv):
+        """Values of all RVs for every run, ordered as for finite differences w.r.t. RVs."""
+        mean_rv = np.asarray(mean_rv, dtype=float)
+        rv_values = [list(mean_rv)]
+        for direction in self.list_direction:
+            step = direction.delta * self.vectors[:, direction.idx]
+            if direction.use_central_differences:
+                rv_values.append(list(mean_rv - step))
+            rv_values.append(list(mean_rv + step))
+        return rv_values
+
+    def project(self, dresp):
+        """Replace directional derivatives of dresp with derivatives w.r.t. all RVs."""
+        dresp.dRV_direction = dresp.dRV
+        dRV = self.vectors.dot(np.asarray(dresp.dRV, dtype=float))[:, None]
+        dRVdDV = self.vectors.dot(np.asarray(dresp.dRVdDV, dtype=float))[:, None]
+        self.restore([dresp.name], dRV, dRVdDV)
+        dresp.dRV = list(dRV[:, 0])
+        dresp.dRVdDV = list(dRVdDV[:, 0])
+
+    def restore(self, names, dRV=None, dRVdDV=None, dvs=slice(None)):
+        """Set derivatives w.r.t. RVs not covered by the runs, none for eigen directions."""
+        pass
+
+    def info(self):
+        print(
+            "Using {:d} eigen directions of the covariance covering {:.1%} of the variance.".format(
+                len(self), self.variance_fraction
+            )
+        )
+
+
+class ScreenedRVs(EigenDirections):
+    """Finite differences only w.r.t. the RVs not frozen by the screening, see rv_screening.py.
+    The solved RVs are handled as directions along unit vectors, the derivatives w.r.t. the
+    frozen RVs are restored from the last cycle in which they were solved.
+    """
+
+    def __init__(self, list_RV, frozen, state):
+        self.frozen = sorted(frozen)
+        self.state = state
+        active = [RV_i for RV_i in list_RV if RV_i.idx not in self.frozen]
+        self.vectors = np.zeros((len(list_RV), len(active)))
+        self.vectors[[RV_i.idx for RV_i in active], np.arange(len(active))] = 1.0
+        self.list_direction = [
+            RV(k, RV_i.mean, RV_i.sigma, RV_i.delta, RV_i.use_central_differences) for k, RV_i in enumerate(active)
+        ]
+        self.full = not self.frozen
+        self.missing = set()
+        if self.frozen:
+            state.load()
+
+    def restore(self, names, dRV=None, dRVdDV=None, dvs=slice(None)):
+        """Set rows of frozen RVs in dRV (RVs x DRESPs) and dRVdDV (RVs x DRESPs x DVs) to the
+        stored derivatives. dvs selects the DVs of dRVdDV from the full layout of all DVs."""
+        if not self.frozen:
+            return
+        for d, name in enumerate(names):
+            stored = self.state.get(name)
+            if stored is None:
+                if name not in self.missing:
+                    print("No derivatives of {} stored for frozen RVs, assumed zero.".format(name))
+                    self.missing.add(name)
+                continue
+            if dRV is not None:
+                dRV[self.frozen, d] = stored[0][self.frozen, stored[2]]
+            if dRVdDV is not None:
+                dRVdDV[self.frozen, d] = self.state.get_dRVdDV(name, self.frozen, dvs)
+
+    def info(self):
+        if self.frozen:
+            print(
+                "RV screening: solving {:d} of {:d} RVs, derivatives w.r.t. RVs {} reused.".format(
+                    len(self), self.vectors.shape[0], [i + 1 for i in self.frozen]
+                )
+            )
+        else:
+            print("RV screening: solving all {:d} RVs.".format(self.vectors.shape[0]))
+
+    def finish(self, cycle, list_DRESP, cov):
+        """Record the state after cycle for the next cycles."""
+        self.state.update(cycle, list_DRESP, np.diag(cov.matrix), self.full, frozen=self.frozen)
+
+
+class BroydenDirections(EigenDirections):
+    """Quasi-Newton update of the derivatives w.r.t. RVs, see rv_screening.py for the state.
+    In a full cycle, finite differences are taken w.r.t. every RV. In between, only a few
+    probe directions (orthonormal columns of V) are solved and the derivatives J stored in
+    the previous cycle are corrected by the secant (Broyden) update J + V * (g - V^T * J),
+    which matches the directional derivatives g along the probes and keeps J elsewhere.
+    The step along probe v is the norm of v scaled by delta_rv.
+    """
+
+    def __init__(self, list_RV, cov, probes, state):
+        self.state = state
+        self.full = probes is None
+        self.errors = {}  # DRESP name -> relative error of the derivatives predicted along the probes
+        self.missing = set()
+        if self.full:
+            self.vectors = np.eye(len(list_RV))
+            self.list_direction = [
+                RV(RV_i.idx, RV_i.mean, RV_i.sigma, RV_i.delta, RV_i.use_central_differences) for RV_i in list_RV
+            ]
+            return
+        self.vectors = np.asarray(probes, dtype=float).T
+        delta = np.asarray([RV_i.delta for RV_i in list_RV], dtype=float)
+        self.list_direction = [
+            RV(
+                k,
+                0,
+                np.sqrt(v.dot(cov.matrix).dot(v)),
+                np.sqrt(np.sum((v * delta) ** 2)),
+                list_RV[0].use_central_differences,
+            )
+            for k, v in enumerate(self.vectors.T)
+        ]
+        if not state.stored:
+            state.load()
+
+    def restore(self, names, dRV=None, dRVdDV=None, dvs=slice(None)):
+        """Add the stored derivatives outside of the probes to dRV (RVs x DRESPs) and dRVdDV
+        (RVs x DRESPs x DVs) holding V * g. dvs selects the DVs of dRVdDV from the full layout."""
+        if self.full:
+            return
+        V = self.vectors
+        for d, name in enumerate(names):
+            stored = self.state.get(name)
+            if stored is None:
+                if name not in self.missing:
+                    print("No derivatives of {} stored for Broyden update, assumed zero.".format(name))
+                    self.missing.add(name)
+                continue
+            if dRV is not None:
+                J = stored[0][:, stored[2]]
+                g, prediction = V.T.dot(dRV[:, d]), V.T.dot(J)
+                scale = np.linalg.norm(g)
+                error = np.linalg.norm(g - prediction)
+                self.errors[name] = error / scale if scale > 0 else (0.0 if error == 0 else np.inf)
+                dRV[:, d] += J - V.dot(prediction)
+            if dRVdDV is not None:
+                J = self.state.get_dRVdDV(name, slice(None), dvs)
+                dRVdDV[:, d] += J - V.dot(V.T.dot(J))
+
+    def info(self):
+        if self.full:
+            print("Broyden update: solving all {:d} RVs.".format(self.vectors.shape[0]))
+        else:
+            print(
+                "Broyden update: solving {:d} probe directions instead of {:d} RVs.".format(
+                    len(self), self.vectors.shape[0]
+                )
+            )
+
+    def finish(self, cycle, list_DRESP, cov):
+        """Record the state after cycle, the error decides whether the next cycle is full."""
+        error = max(self.errors.values()) if self.errors else 0.0
+        if not self.full:
+            print("Broyden update: max. relative error of predicted directional derivatives {:.3g}.".format(error))
+        self.state.update(cycle, list_DRESP, np.diag(cov.matrix), self.full, error=float(error))
+
+
+def get_random_variables(cfg):
+    """Create RV objects from parameters in config_rdo.py."""
+    return [
+        RV(i, cfg.mean_rv[i], cfg.sigma_rv[i], cfg.delta_rv[i], cfg.use_central_differences)
+        for i in range(cfg.number_of_rv)
+    ]
+
+
+def get_eigen_directions(cfg, cov):
+    """Create eigen directions from eigen_directions in config_rdo.py, None if not configured."""
+    settings = getattr(cfg, "eigen_directions", None)
+    if not settings:
+        return None
+    return EigenDirections(
+        cov,
+        cfg.use_central_differences,
+        settings.get("variance_fraction", 1.0),
+        settings.get("max_runs", None),
+        settings.get("step", 1.0),
+    )
+
+
+def get_rv_screening(cfg, list_RV, rdo_work_dir, cycle):
+    """Create ScreenedRVs from rv_screening in config_rdo.py for cycle, None if not configured."""
+    settings = getattr(cfg, "rv_screening", None)
+    if not settings:
+        return None
+    if getattr(cfg, "eigen_directions", None):
+        raise ValueError("RV screening can not be combined with eigen directions.")
+    state = rv_screening.ScreeningState(os.path.join(rdo_work_dir, "rv_screening"), len(list_RV))
+    frozen = state.get_frozen(
+        cycle,
+        settings.get("threshold", 0.01),
+        settings.get("refresh_every", 5),
+        rv_screening.read_design(os.path.join(rdo_work_dir, "tosca_distribution.txt")),
+        settings.get("max_design_change", None),
+    )
+    return ScreenedRVs(list_RV, frozen, state)
+
+
+def get_broyden(cfg, list_RV, cov, rdo_work_dir, cycle):
+    """Create BroydenDirections from broyden in config_rdo.py for cycle, None if not configured.
+    A cycle is full if due by refresh_every or max_design_change, if the error of the last
+    update exceeded max_error or if no derivatives are stored. Otherwise, the probes are the
+    leading left singular vectors of cov * dRV over all stored DRESPs, i.e. the directions in
+    which errors of the derivatives change the variances most."""
+    settings = getattr(cfg, "broyden", None)
+    if not settings:
+        return None
+    if getattr(cfg, "eigen_directions", None) or getattr(cfg, "rv_screening", None):
+        raise ValueError("Broyden update can not be combined with eigen directions or RV screening.")
+    state = rv_screening.ScreeningState(os.path.join(rdo_work_dir, "broyden"), len(list_RV))
+    design = rv_screening.read_design(os.path.join(rdo_work_dir, "tosca_distribution.txt"))
+    number_of_probes = max(1, int(settings.get("probes", 1)))
+
+    def decide():
+        if (
+            number_of_probes >= len(list_RV)
+            or state.is_due(cycle, settings.get("refresh_every", 5), design, settings.get("max_design_change", None))
+            or state.state.get("error", 0.0) > settings.get("max_error", 0.1)
+        ):
+            return {"full": True, "probes": None}
+        state.load()
+        if not state.stored:
+            return {"full": True, "probes": None}
+        dRV = np.stack([stored[0][:, stored[2]] for stored in state.stored.values()], axis=1)
+        M = cov.matrix.dot(dRV)
+        norms = np.linalg.norm(M, axis=0)
+        M = M[:, norms > 0] / norms[norms > 0]
+        U = np.linalg.svd(M, full_matrices=True)[0] if M.size else np.eye(len(list_RV))
+        U = U[:, :number_of_probes]
+        U = U * np.sign(U[np.argmax(np.abs(U), axis=0), np.arange(U.shape[1])])
+        return {"full": False, "probes": [[float(x) for x in u] for u in U.T]}
+
+    return BroydenDirections(list_RV, cov, state.get_plan(cycle, decide, design)["probes"], state)
+
+
+def get_reused_derivatives(cfg, list_RV, cov, rdo_work_dir, cycle):
+    """RV screening or Broyden update of cycle, which reuse derivatives w.r.t. RVs across
+    cycles, None if neither is configured."""
+    screening = get_rv_screening(cfg, list_RV, rdo_work_dir, cycle)
+    if screening is not None:
+        return screening
+    return get_broyden(cfg, list_RV, cov, rdo_work_dir, cycle)
 
 
 class RV(object):
@@ -384,7 +1212,143 @@ class RV(object):
 
 # --------------------------------------------------------------------#
 # MAIN
-def main(args=None, cfg=None):
+def get_storage(cfg, cycle_dir):
+    """Storage of arrays over DVs from config_rdo.py as keyword arguments of DrespBatch."""
+    return {
+        "dtype": np.dtype(getattr(cfg, "storage_dtype", "float64")),
+        "storage_dir": os.path.join(cycle_dir, "arrays") if getattr(cfg, "memory_mapped_storage", False) else None,
+        "chunk_size": getattr(cfg, "dv_chunk_size", None),
+    }
+
+
+_active_dvs_cache = {}  # index arrays read from files, reused across cycles in a long-lived process
+
+
+def get_active_dvs(cfg, input_dir, job):
+    """Active DVs from config_rdo.py: None for all DVs, "auto" or index array (from 0) read
+    from a file in input dir with the ids of the active DVs (from 1) as in the ONF files."""
+    active_dvs = getattr(cfg, "active_dvs", None)
+    if active_dvs is None or active_dvs == "auto":
+        return active_dvs
+    file = os.path.join(input_dir, active_dvs.format(job=job))
+    mtime = os.stat(file).st_mtime_ns
+    if _active_dvs_cache.get(file, (None,))[0] != mtime:
+        with open(file, "r") as f:
+            ids = [int(entry) for line in f for entry in line.split("#")[0].replace(",", " ").split()]
+        _active_dvs_cache[file] = (mtime, np.unique(np.asarray(ids, dtype=int)) - 1)
+    return _active_dvs_cache[file][1]
+
+
+def evaluate(
+    tosca_dirs,
+    result_dir,
+    cfg,
+    list_step,
+    cov,
+    directions,
+    instrumentation,
+    stream=None,
+    cache=None,
+    writer=None,
+    active_dvs=None,
+):
+    """Read results of all runs in tosca_dirs, calculate robust DRESPs and write them to
+    result_dir. Returns list of Dresp objects."""
+    storage = get_storage(cfg, os.path.dirname(tosca_dirs))
+    compact = storage["dtype"] != np.float64 or storage["storage_dir"] is not None or storage["chunk_size"]
+    compact = compact or active_dvs is not None
+    write_elements = cfg.verbose and not getattr(cfg, "history", False)
+    with instrumentation.phase("parse_results"):
+        if stream is not None:
+            # runs already read while solving, only remaining runs are read
+            stream.finish()
+        else:
+            resultsDRESP, resultsSENS = get_results(
+                tosca_dirs,
+                cfg.verbose,
+                getattr(cfg, "number_of_workers", 1),
+                cache,
+            )
+            names = utils.read_names(resultsDRESP[0])
+
+    # ------------------------------------------------------------------------------------#
+    # Create objects for DRESPs, read results and calculate partial derivatives wrt RVs
+    # debug output in verbose mode is written in the background, per-element
+    # debug output is replaced by the binary history if enabled
+    if stream is not None:
+        with instrumentation.phase("moments"):
+            stream.calculate(cov, float(cfg.kappa))
+            list_DRESP = stream.to_dresps()
+        for dresp in list_DRESP:
+            with instrumentation.phase("write_output"):
+                if write_elements:
+                    writer.submit(dresp.write_raw, result_dir).add_done_callback(report_exception)
+                dresp.write_output(
+                    dst=result_dir,
+                    elements=elements,
+                    use_central_differences=cfg.use_central_differences,
+                    verbose=cfg.verbose,
+                    writer=writer,
+                    write_elements=write_elements,
+                )
+    elif getattr(cfg, "batch_dresps", False) or compact:
+        batch = DrespBatch(
+            [name for name in names if "VOL" not in name if "MASS" not in name],
+            list_step,
+            getattr(cfg, "number_of_workers", 1),
+            directions,
+            active_dvs=active_dvs,
+            **storage
+        )
+        with instrumentation.phase("parse_results"):
+            batch.find_values(resultsDRESP)
+            batch.find_sensitivities(resultsSENS)
+            del resultsSENS  # sensitivities are only kept in batch
+        if cfg.verbose and active_dvs is not None:
+            print("Active DVs: {:d} of {:d}".format(batch.numberOfActiveDV, batch.numberOfDV))
+        with instrumentation.phase("moments"):
+            batch.calculate(cov, float(cfg.kappa))
+            list_DRESP = batch.to_dresps()
+        for dresp in list_DRESP:
+            with instrumentation.phase("write_output"):
+                if write_elements:
+                    writer.submit(dresp.write_raw, result_dir).add_done_callback(report_exception)
+                dresp.write_output(
+                    dst=result_dir,
+                    elements=elements,
+                    use_central_differences=cfg.use_central_differences,
+                    verbose=cfg.verbose,
+                    writer=writer,
+                    write_elements=write_elements,
+                )
+    else:
+        list_DRESP = [Dresp(name, list_step) for name in names if "VOL" not in name if "MASS" not in name]
+        for dresp in list_DRESP:
+            with instrumentation.phase("parse_results"):
+                dresp.find_values(resultsDRESP)
+                dresp.find_sensitivities(resultsSENS)
+            if write_elements:
+                writer.submit(dresp.write_raw, result_dir).add_done_callback(report_exception)
+            with instrumentation.phase("moments"):
+                dresp.calculate_partial_derivatives()
+                if directions is not None:
+                    directions.project(dresp)
+                dresp.calculate_objective(cov, float(cfg.kappa))
+            with instrumentation.phase("write_output"):
+                dresp.write_output(
+                    dst=result_dir,
+                    elements=elements,
+                    use_central_differences=cfg.use_central_differences,
+                    verbose=cfg.verbose,
+                    writer=writer,
+                    write_elements=write_elements,
+                )
+    return list_DRESP
+
+
+def main(args=None, cfg=None, instrumentation=None, streams=None):
+    """Post-processing of the inner loop for all FE models in args.job. Pass streams as dict
+    of DrespStream per model if the runs were read while solving."""
     if not args:
         args = utils.get_arguments()
 
@@ -393,39 +1357,79 @@ def main(args=None, cfg=None):
         sys.path.append(args.input_dir)
         import config_rdo as cfg
 
-    rdo_work_dir = os.path.join(args.input_dir, "{}_RDO".format(args.job))
-    tosca_dirs = os.path.join(rdo_work_dir, "inner_loop", "{:s}_{:03d}".format(args.job, args.cycle), "tosca")
+    if instrumentation is None:
+        instrumentation = Instrumentation(enabled=False)
+
+    jobs = utils.get_jobs(args.job)
+    rdo_work_dir = os.path.join(args.input_dir, getattr(args, "work_dir", None) or "{}_RDO".format(jobs[0]))
 
     # ------------------------------------------------------------------------------------#
     # Create objects for RVs and read results
-    list_RV = [
-        RV(i, cfg.mean_rv[i], cfg.sigma_rv[i], cfg.delta_rv[i], cfg.use_central_differences)
-        for i in range(cfg.number_of_rv)
-    ]
-    cov = get_covariance(list_RV, cfg.verbose)
-
-    resultsDRESP, resultsSENS = get_results(tosca_dirs, cfg.verbose)
+    list_RV = get_random_variables(cfg)
+    cov = get_covariance(list_RV, cfg.verbose, getattr(cfg, "correlation_rv", None))
+    directions = get_eigen_directions(cfg, cov)
+    reuse = get_reused_derivatives(cfg, list_RV, cov, rdo_work_dir, args.cycle)
+    if reuse is not None:
+        directions = reuse  # finite differences w.r.t. RVs not frozen or along probes
+    if directions is not None:
+        directions.info()
+        list_step = directions.list_direction  # finite differences along eigen directions
+    else:
+        list_step = list_RV
 
-    # ------------------------------------------------------------------------------------#
-    # Create objects for DRESPs, read results and calculate partial derivatives wrt RVs
-    # get DRESPS
-    names = utils.read_names(resultsDRESP[0])
-    list_DRESP = [Dresp(name, list_RV) for name in names if "VOL" not in name if "MASS" not in name]
-    for dresp in list_DRESP:
-        dresp.find_values(resultsDRESP)
-        dresp.find_sensitivities(resultsSENS)
-        if cfg.verbose:
-            dresp.write_raw(args.result_dir)
-        dresp.calculate_partial_derivatives()
-        dresp.calculate_objective(cov, float(cfg.kappa))
-        dresp.write_output(
-            dst=args.result_dir,
-            elements=elements,
-            use_central_differences=cfg.use_central_differences,
-            verbose=cfg.verbose,
+    # DRESPs of all models are written together, one status file and history for all models
+    cache = result_cache.from_config(cfg, args.input_dir)
+    writer = ThreadPoolExecutor(max_workers=1) if cfg.verbose else None
+    names = []
+    for job in jobs:
+        tosca_dirs = os.path.join(rdo_work_dir, "inner_loop", "{:s}_{:03d}".format(job, args.cycle), "tosca")
+        for name in read_dresp_names(tosca_dirs, (streams or {}).get(job), cache):
+            if name in names:
+                raise ValueError("DRESP {} is defined in several FE models.".format(name))
+            names.append(name)
+    list_DRESP = []
+    for job in jobs:
+        cycle_dir = os.path.join(rdo_work_dir, "inner_loop", "{:s}_{:03d}".format(job, args.cycle))
+        result_dir = os.path.join(cycle_dir, "sensitivities")
+        if len(jobs) == 1 and args.result_dir:
+            result_dir = args.result_dir
+        dresps = evaluate(
+            os.path.join(cycle_dir, "tosca"),
+            result_dir,
+            cfg,
+            list_step,
+            cov,
+            directions,
+            instrumentation,
+            (streams or {}).get(job),
+            cache,
+            writer,
+            get_active_dvs(cfg, args.input_dir, job),
         )
-    write_status(rdo_work_dir, list_DRESP, args.cycle, cfg.kappa)
+        list_DRESP += dresps
+        if reuse is not None:
+            reuse.state.store(job, dresps)
+    if reuse is not None:
+        reuse.finish(args.cycle, list_DRESP, cov)
 
+    with instrumentation.phase("write_output"):
+        write_status(rdo_work_dir, list_DRESP, args.cycle, cfg.kappa)
+        if getattr(cfg, "history", False):
+            history.History(os.path.join(rdo_work_dir, "history")).append(
+                args.cycle, cfg.kappa, list_DRESP, cfg.verbose
+            )
+    if writer is not None:
+        writer.shutdown(wait=False)
+    if getattr(cfg, "memory_mapped_storage", False) and not cfg.verbose:
+        # files can not be removed while mapped on Windows, all views on them are released first
+        del list_DRESP, dresps
+        for stream in (streams or {}).values():
+            stream.release()
+        gc.collect()
+        for job in jobs:
+            cycle_dir = os.path.join(rdo_work_dir, "inner_loop", "{:s}_{:03d}".format(job, args.cycle))
+            if os.path.exists(os.path.join(cycle_dir, "arrays")):
+                shutil.rmtree(os.path.join(cycle_dir, "arrays"), onerror=report_remove_error)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+# Module for completion markers of finite difference runs. After a successful
+# run, a marker with the key of its inputs (job files and RV values, see
+# result_cache.get_keys) and checksums of its outputs is written to the run
+# directory. If a cycle is restarted after a crash, runs with a valid marker
+# are not solved again.
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import json
+import hashlib
+from glob import glob
+
+# --------------------------------------------------------------------#
+# Name of completion marker written to run directories
+MARKER_FILE = "run_complete.json"
+
+# Outputs of a run required for the post-processing, status files as read by
+# calculate_derivatives.read_run
+STATUS_PATTERN = "optimization_status*.csv"
+SENSITIVITY_FILE = "TP_SENS_000.onf"
+
+
+# --------------------------------------------------------------------#
+def checksum(file, chunk_size=2**20):
+    """SHA-256 of file content as hex string."""
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_output_files(run_dir):
+    """Names of the outputs of run required for the post-processing, None if missing."""
+    status_files = sorted(os.path.basename(file) for file in glob(os.path.join(run_dir, STATUS_PATTERN)))
+    if not status_files or not os.path.exists(os.path.join(run_dir, SENSITIVITY_FILE)):
+        return None
+    return status_files + [SENSITIVITY_FILE]
+
+
+def write_marker(run_dir, input_key, output_files=None):
+    """Write completion marker of run for output_files, default: get_output_files().
+    Returns False without marker if outputs are missing."""
+    if output_files is None:
+        output_files = get_output_files(run_dir)
+        if output_files is None:
+            return False
+    outputs = {}
+    for name in output_files:
+        file = os.path.join(run_dir, name)
+        if not os.path.exists(file):
+            return False
+        outputs[name] = checksum(file)
+
+    marker = os.path.join(run_dir, MARKER_FILE)
+    with open(marker + ".tmp", "w") as f:
+        json.dump({"input": input_key, "outputs": outputs}, f)
+    os.replace(marker + ".tmp", marker)
+    return True
+
+
+def read_marker(run_dir):
+    """Return content of completion marker or None if not available."""
+    try:
+        with open(os.path.join(run_dir, MARKER_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_marker(run_dir):
+    marker = os.path.join(run_dir, MARKER_FILE)
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+def is_complete(run_dir, input_key):
+    """True if run has a marker for input_key and all outputs match their checksums."""
+    marker = read_marker(run_dir)
+    if marker is None or marker.get("input") != input_key:
+        return False
+    for name, value in marker.get("outputs", {}).items():
+        file = os.path.join(run_dir, name)
+        if not os.path.exists(file) or checksum(file) != value:
+            return False
+    return True
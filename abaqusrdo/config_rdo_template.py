@@ -7,9 +7,121 @@ mean_rv = number_of_rv * [100]      # Or rv-specific: [100, 110]
 sigma_rv = number_of_rv * [1000]    # Or rv-specific: [1000, 900]
 delta_rv = number_of_rv * [1500]    # Or rv-specific: [1400, 1600]
 
+# Correlation of RVs (0-based indices), None for uncorrelated RVs. Options:
+#   dense matrix:   [[1, 0.5], [0.5, 1]]
+#   sparse pairs:   {"pairs": [(0, 1, 0.5)]}
+#   kernel:         {"kernel": "exponential", "coordinates": [0.0, 10.0], "length": 20.0}
+
+correlation_rv = None
+
+# Finite differences along the leading eigenvectors of the covariance instead of
+# every RV (requires executor = "local"), None to disable. Directions are added
+# until variance_fraction is covered or max_runs is reached; the step along a
+# direction is step * sqrt(eigenvalue).
+# Example: {"variance_fraction": 0.95, "max_runs": 11, "step": 1.5}
+
+eigen_directions = None
+
+# Screening of RVs (requires executor = "local"), None to disable. RVs whose share
+# dRV_i^2 * sigma_i^2 of the variance of every DRESP is below threshold are frozen:
+# their runs are skipped and their last derivatives reused. All RVs are solved
+# every refresh_every cycles and if the RMS change of tosca_distribution.txt since
+# the last full cycle exceeds max_design_change.
+# Example: {"threshold": 0.01, "refresh_every": 5, "max_design_change": 0.05}
+
+rv_screening = None
+
+# Broyden (quasi-Newton) update of the derivatives w.r.t. RVs (requires executor =
+# "local"), None to disable. Between full cycles, only the mean run and the probe
+# directions are solved and the derivatives of the last cycle are updated by a secant
+# update along the probes. A full cycle follows every refresh_every cycles, if the RMS
+# change of tosca_distribution.txt exceeds max_design_change or if the relative error
+# of the derivatives predicted along the probes exceeded max_error.
+# Example: {"probes": 1, "refresh_every": 5, "max_error": 0.1, "max_design_change": 0.05}
+
+broyden = None
+
 use_central_differences = False
 kappa = 1
 
+# Set to true to process all DRESPs in one batch. Number of threads used to
+# read run directories and split the design variables of the batch
+
+batch_dresps = False
+number_of_workers = 1
+
+# Executor for finite difference runs: "isight" launches inner_loop.zmf, "local"
+# launches solver_command in every run directory from Python, "slurm" or "pbs"
+# submit all runs as one job array. Fields {job}, {run}, {run_dir}, {cpus},
+# {rv_values} and {input_dir} are replaced per run.
+
+executor = "isight"
+solver_command = "ToscaStructure -j {job}.par --cpus {cpus}"
+run_files = ["{job}.inp", "{job}.par"]
+staging = "copy"        # "copy", "hardlink" or "symlink" to shared run_files
+rv_deck = None          # e.g. "{job}.inp" with placeholders <rv_1>, <rv_2>, ...
+number_of_parallel_runs = 1
+cpus_per_run = 1
+license_tokens = None   # total tokens available, None for no limit
+tokens_per_run = 0
+max_retries = 0         # launches of a failed run in addition to the first one
+scheduler_options = ""  # e.g. "--partition=compute --time=02:00:00" for sbatch
+poll_interval = 5.0     # initial and max. interval (s) of polling the job array
+max_poll_interval = 60.0
+max_unknown_polls = 10  # failed queries of the array in a row until remaining runs fail
+scheduler_timeout = None  # max. time (s) of a job array, None for no limit
+
+# Set to true to resume a crashed cycle, only runs without valid completion marker
+# (run_complete.json) are solved again (requires executor = "local")
+
+resume = False
+
+# Set to true to read every finite difference run as soon as it is complete while
+# the remaining runs are solved (requires executor = "local")
+
+streaming = False
+
+# Storage of the arrays over DVs: data type (e.g. "float32" halves the memory),
+# memory-mapped files in inner_loop/<job>_XXX/arrays and max. number of DVs
+# processed at once. Any of these options implies batch_dresps.
+
+storage_dtype = "float64"
+memory_mapped_storage = False
+dv_chunk_size = None
+
+# DVs kept in post-processing, e.g. without frozen elements: None for all DVs, "auto"
+# for all DVs with non-zero sensitivity in any run or file with ids of active DVs,
+# e.g. "{job}_active_dvs.txt". Implies batch_dresps.
+
+active_dvs = None
+
+# Directory of result cache relative to input dir for executor = "local", None to
+# disable. Least recently used entries are evicted above size (bytes) or entries.
+
+result_cache_dir = None
+result_cache_size = None
+result_cache_entries = None
+
+# Retention of cycle directories in <job>_RDO/inner_loop, removed in the background.
+# keep_last_cycles = "all" keeps all cycles, None for the default: 1 ("all" in verbose mode).
+# Disk usage is capped at max_inner_loop_size (bytes) by removing the oldest cycles.
+
+keep_last_cycles = None
+keep_every_cycle = None
+keep_failed_cycles = True
+max_inner_loop_size = None
+archive_cycles = False
+
+# Set to true to save values, derivatives and robust objectives of all DRESPs per
+# cycle as binary history in <job>_RDO/history, replacing per-element debug CSVs
+
+history = False
+
+# Set to true to record time and resources of every phase of the inner loop in
+# <job>_RDO/inner_loop_resources.jsonl and print a summary per cycle
+
+instrumentation = True
+
 # Set to true if running on windows machine, false if running on linux
 
 run_on_windows = True
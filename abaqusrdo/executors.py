@@ -0,0 +1,489 @@
+# Module with executors to launch the finite difference runs of the inner loop
+# directly from Python as an alternative to the Isight model inner_loop.zmf.
+# Every run is started as a separate solver process in its run directory, either
+# on the local machine or as task of a job array of a batch scheduler (Slurm, PBS).
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import sys
+import time
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+
+
+# --------------------------------------------------------------------#
+def get_rv_values(mean_rv, delta_rv, use_central_differences):
+    """Values of all RVs for every finite difference run, ordered as the run directories.
+    Run 0 is the mean, followed by the forward (and backward) step of each RV.
+    """
+    mean_rv = [float(mean) for mean in mean_rv]
+    rv_values = [list(mean_rv)]
+    for i, delta in enumerate(delta_rv):
+        if use_central_differences:
+            backward = list(mean_rv)
+            backward[i] -= float(delta)
+            rv_values.append(backward)
+        forward = list(mean_rv)
+        forward[i] += float(delta)
+        rv_values.append(forward)
+    return rv_values
+
+
+def write_rv_parameters(run_dir, rv_values, file_name="rv_parameters.inp"):
+    """Write RV values of run as Abaqus *PARAMETER block to be included in the input file."""
+    file = os.path.join(run_dir, file_name)
+    with open(file, "w") as f:
+        f.write("*PARAMETER\n")
+        for i, value in enumerate(rv_values):
+            f.write("rv_{:d} = {:.15E}\n".format(i + 1, value))
+    return file
+
+
+class RunResult(object):
+    """Exit status, log file and duration of a single finite difference run."""
+
+    def __init__(self, run, run_dir, returncode, log_file, duration, attempts=1):
+        self.run = run
+        self.run_dir = run_dir
+        self.returncode = returncode
+        self.log_file = log_file
+        self.duration = duration
+        self.attempts = attempts
+
+    @property
+    def success(self):
+        return self.returncode == 0
+
+    def __str__(self):
+        return "run_{:03d}: exit status {} after {:.1f} s ({:d} attempts), log {}".format(
+            self.run, self.returncode, self.duration, self.attempts, self.log_file
+        )
+
+
+def from_config(cfg):
+    """Create executor from settings in config_rdo.py, None for executor = "isight"."""
+    name = getattr(cfg, "executor", "isight")
+    if name == "isight":
+        return None
+    if name == "local":
+        return LocalExecutor(
+            cfg.solver_command,
+            getattr(cfg, "number_of_parallel_runs", 1),
+            getattr(cfg, "cpus_per_run", 1),
+            getattr(cfg, "license_tokens", None),
+            getattr(cfg, "tokens_per_run", 0),
+            cfg.verbose,
+            getattr(cfg, "max_retries", 0),
+        )
+    if name in SCHEDULERS:
+        return SchedulerExecutor(
+            cfg.solver_command,
+            getattr(cfg, "number_of_parallel_runs", None),
+            getattr(cfg, "cpus_per_run", 1),
+            getattr(cfg, "license_tokens", None),
+            getattr(cfg, "tokens_per_run", 0),
+            cfg.verbose,
+            getattr(cfg, "max_retries", 0),
+            SCHEDULERS[name](),
+            getattr(cfg, "scheduler_options", ""),
+            getattr(cfg, "poll_interval", 5.0),
+            getattr(cfg, "max_poll_interval", 60.0),
+            getattr(cfg, "max_unknown_polls", 10),
+            getattr(cfg, "scheduler_timeout", None),
+        )
+    raise ValueError("Unknown executor {}.".format(name))
+
+
+class Executor(object):
+    """Base class of executors launching one solver process per run directory.
+    The solver command is a format string with the fields {run}, {run_dir}, {cpus},
+    {rv_values} and all keyword arguments passed to run(), e.g. {job} and {input_dir}.
+    The RV values are additionally passed as environment variables RDO_RV_<i> and
+    written to rv_parameters.inp in each run directory. Failed runs are launched
+    again up to retries times. Subclasses implement run_tasks().
+    """
+
+    log_file_name = "solver.log"
+
+    def __init__(
+        self,
+        solver_command,
+        number_of_parallel_runs=1,
+        cpus_per_run=1,
+        license_tokens=None,
+        tokens_per_run=0,
+        verbose=False,
+        retries=0,
+    ):
+        self.solver_command = solver_command
+        self.number_of_parallel_runs = number_of_parallel_runs  # None: not limited, e.g. by a scheduler
+        if number_of_parallel_runs is not None:
+            self.number_of_parallel_runs = max(1, int(number_of_parallel_runs))
+        self.cpus_per_run = max(1, int(cpus_per_run))
+        self.license_tokens = license_tokens
+        self.tokens_per_run = tokens_per_run
+        self.verbose = verbose
+        self.retries = max(0, int(retries))
+
+    @property
+    def concurrency(self):
+        """Number of runs executed at once within the license-token budget, None if not limited."""
+        concurrency = self.number_of_parallel_runs
+        if self.license_tokens is not None and self.tokens_per_run > 0:
+            tokens = int(self.license_tokens // self.tokens_per_run)
+            concurrency = tokens if concurrency is None else min(concurrency, tokens)
+            if concurrency < 1:
+                raise ValueError(
+                    "License-token budget of {} is too small for {} tokens per run.".format(
+                        self.license_tokens, self.tokens_per_run
+                    )
+                )
+        return concurrency
+
+    def run(self, runtime_dirs, rv_values, runs=None, callback=None, **fields):
+        """Execute solver in run directories and return list of RunResult.
+        Only the run indices in runs are executed if given, otherwise all runs.
+        callback is called with the RunResult of every run as soon as it is complete.
+        """
+        if runs is None:
+            runs = range(len(runtime_dirs))
+        return self.run_tasks([(run, runtime_dirs[run], rv_values[run], fields, callback) for run in runs])
+
+    def run_tasks(self, tasks):
+        """Execute tasks (run, run_dir, rv_values, fields, callback), e.g. the runs of
+        several jobs, and return list of RunResult in the order of tasks."""
+        raise NotImplementedError
+
+    def _get_command(self, run, run_dir, rv_values, fields):
+        return self.solver_command.format(
+            run=run,
+            run_dir=run_dir,
+            cpus=self.cpus_per_run,
+            rv_values=" ".join("{:.15E}".format(value) for value in rv_values),
+            **fields
+        )
+
+    def _get_environment(self, run, rv_values):
+        env = {"RDO_RUN": str(run), "RDO_CPUS": str(self.cpus_per_run)}
+        for i, value in enumerate(rv_values):
+            env["RDO_RV_{:d}".format(i + 1)] = "{:.15E}".format(value)
+        return env
+
+    def _report(self, result, callback=None):
+        if self.verbose or not result.success:
+            print(result)
+            sys.stdout.flush()
+        if callback is not None:
+            callback(result)
+
+
+class LocalExecutor(Executor):
+    """Executor launching one solver process per run directory on the local machine,
+    at most concurrency runs at once."""
+
+    def run_tasks(self, tasks):
+        """Execute tasks (run, run_dir, rv_values, fields, callback) in one pool, e.g. the
+        runs of several jobs, and return list of RunResult in the order of tasks."""
+        if self.verbose:
+            print(
+                "Launching {} runs with {} in parallel, {} cpus per run.".format(
+                    len(tasks), self.concurrency, self.cpus_per_run
+                ),
+                flush=True,
+            )
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._run_single, *task) for task in tasks]
+            results = [future.result() for future in futures]
+        return results
+
+    def _run_single(self, run, run_dir, rv_values, fields, callback=None):
+        """Launch solver for a single run and wait for its completion."""
+        write_rv_parameters(run_dir, rv_values)
+        command = self._get_command(run, run_dir, rv_values, fields)
+        log_file = os.path.join(run_dir, self.log_file_name)
+        if self.verbose:
+            print("run_{:03d}: {}".format(run, command), flush=True)
+
+        start = time.time()
+        for attempt in range(1, self.retries + 2):
+            with open(log_file, "w" if attempt == 1 else "a") as log:
+                if attempt > 1:
+                    log.write("\n--- attempt {:d} ---\n".format(attempt))
+                    log.flush()
+                cp = sp.run(
+                    command,
+                    shell=True,
+                    cwd=run_dir,
+                    env=dict(os.environ, **self._get_environment(run, rv_values)),
+                    stdout=log,
+                    stderr=sp.STDOUT,
+                )
+            if cp.returncode == 0:
+                break
+            if attempt <= self.retries:
+                print("run_{:03d}: exit status {}, retrying.".format(run, cp.returncode), flush=True)
+        result = RunResult(run, run_dir, cp.returncode, log_file, time.time() - start, attempt)
+        self._report(result, callback)
+        return result
+
+
+# --------------------------------------------------------------------#
+# Batch schedulers
+class Slurm(object):
+    """Job arrays submitted with sbatch, state of the array queried with squeue, cancelled with scancel."""
+
+    index_variable = "SLURM_ARRAY_TASK_ID"
+
+    def __init__(self, submit="sbatch", query="squeue", cancel="scancel"):
+        self.submit = submit
+        self.query = query
+        self.cancel = cancel
+
+    def get_submit_command(self, script, size, limit, cpus, log_dir, options=""):
+        array = "0-{:d}".format(size - 1) + ("%{:d}".format(limit) if limit and limit < size else "")
+        return '{} --parsable --array={} --cpus-per-task={:d} --output="{}" {} "{}"'.format(
+            self.submit, array, cpus, os.path.join(log_dir, "slurm-%A_%a.out"), options, script
+        )
+
+    def get_job_id(self, output):
+        return output.strip().split(";")[0]  # <job id>[;<cluster>]
+
+    def get_query_command(self, job_id):
+        return "{} -h -j {} -o %i".format(self.query, job_id)
+
+    def get_cancel_command(self, job_id):
+        return "{} {}".format(self.cancel, job_id)
+
+    def is_active(self, cp):
+        """True if tasks of the array are pending or running, None if unknown, e.g. query failed."""
+        if cp.returncode == 0:
+            return bool(cp.stdout.strip())
+        if "Invalid job id" in cp.stdout + cp.stderr:  # array already purged
+            return False
+        return None
+
+
+class PBS(object):
+    """Job arrays submitted with qsub, state of the array queried with qstat, cancelled with qdel (PBS Pro)."""
+
+    index_variable = "PBS_ARRAY_INDEX"
+
+    def __init__(self, submit="qsub", query="qstat", cancel="qdel"):
+        self.submit = submit
+        self.query = query
+        self.cancel = cancel
+
+    def get_submit_command(self, script, size, limit, cpus, log_dir, options=""):
+        array = "-J 0-{:d}".format(size - 1) if size > 1 else ""  # arrays need at least two tasks
+        return '{} {} -l select=1:ncpus={:d} -j oe -o "{}" {} "{}"'.format(
+            self.submit, array, cpus, log_dir, options, script
+        )
+
+    def get_job_id(self, output):
+        return output.strip()
+
+    def get_query_command(self, job_id):
+        return "{} {}".format(self.query, job_id)
+
+    def get_cancel_command(self, job_id):
+        return "{} {}".format(self.cancel, job_id)
+
+    def is_active(self, cp):
+        """True if tasks of the array are pending or running, None if unknown, e.g. query failed."""
+        if cp.returncode == 0:
+            return bool(cp.stdout.strip())
+        if "Unknown Job Id" in cp.stdout + cp.stderr or "has finished" in cp.stdout + cp.stderr:
+            return False
+        return None
+
+
+SCHEDULERS = {"slurm": Slurm, "pbs": PBS}
+
+
+class SchedulerExecutor(Executor):
+    """Executor submitting all runs as one job array to a batch scheduler, so the runs are
+    spread across the nodes of a cluster. The command of each run is written to solver.sh
+    in its run directory, every task of the array runs one of them and writes its exit
+    status to the file exit_status. The run directories are polled for exit status files
+    with intervals growing from poll_interval to max_poll_interval while nothing completes.
+    Runs without exit status after the array left the queue, e.g. cancelled by the scheduler,
+    failed with exit status -1. Failed runs are submitted again as a new array up to retries
+    times. Options of the submit command (e.g. partition, time limit) are passed as options,
+    concurrency limits the number of tasks running at once (Slurm only). If the state of the
+    array can not be queried max_unknown_polls times in a row or the array does not complete
+    within timeout seconds, the array is cancelled and the remaining runs fail with exit
+    status -1 as well.
+    """
+
+    script_file_name = "solver.sh"
+    exit_file_name = "exit_status"
+
+    def __init__(
+        self,
+        solver_command,
+        number_of_parallel_runs=None,
+        cpus_per_run=1,
+        license_tokens=None,
+        tokens_per_run=0,
+        verbose=False,
+        retries=0,
+        scheduler=None,
+        options="",
+        poll_interval=5.0,
+        max_poll_interval=60.0,
+        max_unknown_polls=10,
+        timeout=None,
+    ):
+        Executor.__init__(
+            self,
+            solver_command,
+            number_of_parallel_runs,
+            cpus_per_run,
+            license_tokens,
+            tokens_per_run,
+            verbose,
+            retries,
+        )
+        self.scheduler = scheduler if scheduler is not None else Slurm()
+        self.options = options
+        self.poll_interval = float(poll_interval)
+        self.max_poll_interval = max(float(max_poll_interval), self.poll_interval)
+        self.max_unknown_polls = max_unknown_polls
+        self.timeout = timeout
+
+    def run_tasks(self, tasks):
+        """Submit tasks (run, run_dir, rv_values, fields, callback) as job array and wait for
+        their completion. Returns list of RunResult in the order of tasks."""
+        results = [None] * len(tasks)
+        pending = list(range(len(tasks)))
+        for attempt in range(1, self.retries + 2):
+            for num, result in zip(pending, self._run_array([tasks[num] for num in pending], attempt)):
+                results[num] = result
+            pending = [num for num in pending if not results[num].success]
+            if not pending or attempt > self.retries:
+                break
+            print("Submitting {} failed runs again.".format(len(pending)), flush=True)
+        return results
+
+    def _write_scripts(self, tasks, attempt):
+        """Write solver.sh to every run directory and the array script with the list of run
+        directories to the directory of the first run directory. Returns path of array script."""
+        for run, run_dir, rv_values, fields, _ in tasks:
+            write_rv_parameters(run_dir, rv_values)
+            with open(os.path.join(run_dir, self.script_file_name), "w") as f:
+                f.write("#!/bin/sh\n")
+                for key, value in sorted(self._get_environment(run, rv_values).items()):
+                    f.write("export {}={}\n".format(key, value))
+                f.write(self._get_command(run, run_dir, rv_values, fields) + "\n")
+            log_file = os.path.join(run_dir, self.log_file_name)
+            with open(log_file, "w" if attempt == 1 else "a") as log:
+                if attempt > 1:
+                    log.write("\n--- attempt {:d} ---\n".format(attempt))
+            if os.path.exists(os.path.join(run_dir, self.exit_file_name)):
+                os.remove(os.path.join(run_dir, self.exit_file_name))
+
+        array_dir = os.path.dirname(tasks[0][1])
+        run_list = os.path.join(array_dir, "array_runs.txt")
+        with open(run_list, "w") as f:
+            f.write("".join(run_dir + "\n" for _, run_dir, _, _, _ in tasks))
+        script = os.path.join(array_dir, "array.sh")
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\n")
+            f.write('RUN_DIR=$(sed -n "$((${{{}:-0}} + 1))p" "{}")\n'.format(self.scheduler.index_variable, run_list))
+            f.write('cd "$RUN_DIR" || exit 1\n')
+            f.write("sh {} >> {} 2>&1\n".format(self.script_file_name, self.log_file_name))
+            f.write("STATUS=$?\n")
+            f.write("echo $STATUS > {0}.tmp && mv {0}.tmp {0}\n".format(self.exit_file_name))
+            f.write("exit $STATUS\n")
+        return script
+
+    def _submit(self, script, size):
+        command = self.scheduler.get_submit_command(
+            script, size, self.concurrency, self.cpus_per_run, os.path.dirname(script), self.options
+        )
+        if self.verbose:
+            print(command, flush=True)
+        cp = sp.run(command, shell=True, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+        if cp.returncode != 0:
+            raise RuntimeError("Submission of job array failed: {}".format(cp.stderr.strip() or cp.stdout.strip()))
+        return self.scheduler.get_job_id(cp.stdout)
+
+    def _is_active(self, job_id):
+        cp = sp.run(
+            self.scheduler.get_query_command(job_id),
+            shell=True,
+            stdout=sp.PIPE,
+            stderr=sp.PIPE,
+            universal_newlines=True,
+        )
+        return self.scheduler.is_active(cp)
+
+    def _cancel(self, job_id):
+        """Cancel the remaining tasks of the array, so runs given up are not solved anyway."""
+        command = self.scheduler.get_cancel_command(job_id)
+        if self.verbose:
+            print(command, flush=True)
+        cp = sp.run(command, shell=True, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+        if cp.returncode != 0:
+            message = cp.stderr.strip() or cp.stdout.strip()
+            print("Cancelling job array {} failed: {}".format(job_id, message), flush=True)
+
+    def _read_exit_status(self, run_dir):
+        try:
+            with open(os.path.join(run_dir, self.exit_file_name), "r") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):  # not written (yet)
+            return None
+
+    def _run_array(self, tasks, attempt):
+        """Submit tasks as one job array and poll until all tasks are complete. Runs are
+        reported through their callback as soon as their exit status is found, unless they
+        failed and are submitted again. Returns list of RunResult."""
+        job_id = self._submit(self._write_scripts(tasks, attempt), len(tasks))
+        print("Submitted {} runs as job array {}.".format(len(tasks), job_id), flush=True)
+
+        start = time.time()
+        results = [None] * len(tasks)
+        interval = self.poll_interval
+        inactive = 0
+        unknown = 0  # consecutive polls in which the state of the array could not be queried
+        lost = False  # remaining runs are given up
+        while None in results:
+            time.sleep(interval)
+            progress = False
+            for num, (run, run_dir, _, _, callback) in enumerate(tasks):
+                if results[num] is not None:
+                    continue
+                returncode = self._read_exit_status(run_dir)
+                if returncode is None and (inactive > 1 or lost):
+                    returncode = -1
+                if returncode is None:
+                    continue
+                progress = True
+                log_file = os.path.join(run_dir, self.log_file_name)
+                results[num] = RunResult(run, run_dir, returncode, log_file, time.time() - start, attempt)
+                if results[num].success or attempt > self.retries:
+                    self._report(results[num], callback)
+                else:
+                    print("run_{:03d}: exit status {}, retrying.".format(run, returncode), flush=True)
+            if progress:
+                interval = self.poll_interval
+                unknown = 0
+                continue
+            interval = min(1.5 * interval, self.max_poll_interval)
+            # runs missing after the array left the queue are given one more interval,
+            # e.g. for exit status files on a shared file system
+            active = self._is_active(job_id)
+            inactive = inactive + 1 if active is False else 0
+            unknown = unknown + 1 if active is None else 0
+            if self.max_unknown_polls and unknown >= self.max_unknown_polls and not lost:
+                print("State of job array {} unknown, giving up remaining runs.".format(job_id), flush=True)
+                lost = True
+            if self.timeout and time.time() - start > self.timeout and not lost:
+                print("Job array {} timed out, giving up remaining runs.".format(job_id), flush=True)
+                lost = True
+            if lost:
+                # cancelled before the runs are marked failed and submitted again
+                self._cancel(job_id)
+        return results
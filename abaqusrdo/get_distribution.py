@@ -11,8 +11,8 @@ def main():
     src = os.path.join(root, "tosca_distribution.txt")
     dst = os.getcwd()
 
-    shutil.copy(src, dst)
-    os.remove(src)
+    # rename on the same file system, copy only across file systems
+    shutil.move(src, os.path.join(dst, os.path.basename(src)))
     print("Moved distribution {} to {}".format(src, dst))
 
 
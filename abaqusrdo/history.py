@@ -0,0 +1,126 @@
+# Module for a binary history of the inner loop. For every cycle, the values,
+# derivatives and robust objectives of all DRESPs are saved as .npy files in
+# history/cycle_XXX and the cycle is appended to the index history/index.jsonl.
+# The arrays are loaded lazily through memory mapping, e.g. for convergence
+# studies:
+#
+#   import history
+#   h = history.History("<input>/<job>_RDO/history")
+#   objective = h.series("objective")       # cycles x DRESPs
+#   dRVdDV = h.load(5)["dRVdDV"]             # RVs x DRESPs x DVs, memory-mapped
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import json
+import shutil
+import numpy as np
+
+# --------------------------------------------------------------------#
+INDEX_FILE = "index.jsonl"
+
+
+# --------------------------------------------------------------------#
+def get_arrays(list_DRESP):
+    """Arrays of all DRESPs to be saved in the history, with DRESPs on the second axis
+    for run/RV-dependent quantities and on the first axis for quantities per DRESP.
+    Arrays over DVs are written by save_dv_arrays()."""
+    return {
+        "value": np.stack([np.asarray(dresp.value, dtype=float) for dresp in list_DRESP], axis=1),
+        "dRV": np.stack([np.asarray(dresp.dRV, dtype=float) for dresp in list_DRESP], axis=1),
+        "mean": np.asarray([dresp.mean for dresp in list_DRESP], dtype=float),
+        "sigma": np.asarray([dresp.sigma for dresp in list_DRESP], dtype=float),
+        "objective": np.asarray([dresp.objective for dresp in list_DRESP], dtype=float),
+    }
+
+
+def save_dv_arrays(directory, list_DRESP):
+    """Save dRVdDV (RVs x DRESPs x DVs) and dObjective_dDV (DRESPs x DVs) of all DRESPs to
+    directory in the storage dtype and the full layout of all DVs. Rows are written one by
+    one into memory-mapped files, so no copy of the arrays of all DRESPs is held in memory."""
+    dtype = np.result_type(*[np.asarray(dresp.dObjective_dDV).dtype for dresp in list_DRESP])
+    number_of_dv = len(list_DRESP[0].expand(np.asarray(list_DRESP[0].dObjective_dDV)))
+    number_of_rv = len(list_DRESP[0].dRVdDV)
+    shape = (number_of_rv, len(list_DRESP), number_of_dv)
+    dRVdDV = np.lib.format.open_memmap(os.path.join(directory, "dRVdDV.npy"), mode="w+", dtype=dtype, shape=shape)
+    dObjective_dDV = np.lib.format.open_memmap(
+        os.path.join(directory, "dObjective_dDV.npy"), mode="w+", dtype=dtype, shape=shape[1:]
+    )
+    for d, dresp in enumerate(list_DRESP):
+        for i, row in enumerate(dresp.dRVdDV):
+            dRVdDV[i, d] = dresp.expand(np.asarray(row))
+        dObjective_dDV[d] = dresp.expand(np.asarray(dresp.dObjective_dDV))
+    dRVdDV.flush()
+    dObjective_dDV.flush()
+    del dRVdDV, dObjective_dDV
+
+
+class History(object):
+    """Append-only binary history of all cycles of the inner loop."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def append(self, cycle, kappa, list_DRESP, verbose=False):
+        """Save arrays of all DRESPs for cycle and add cycle to index."""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        name = "cycle_{:03d}".format(cycle)
+        cycle_dir = os.path.join(self.directory, name)
+        tmp_dir = cycle_dir + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        for key, array in get_arrays(list_DRESP).items():
+            np.save(os.path.join(tmp_dir, key + ".npy"), array)
+        save_dv_arrays(tmp_dir, list_DRESP)
+        if os.path.exists(cycle_dir):  # cycle repeated, e.g. after restart
+            shutil.rmtree(cycle_dir)
+        os.rename(tmp_dir, cycle_dir)
+
+        entry = {
+            "cycle": int(cycle),
+            "kappa": float(kappa),
+            "names": [dresp.name for dresp in list_DRESP],
+            "directory": name,
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        if verbose:
+            print("Saved cycle {} to history {}".format(cycle, self.directory))
+
+    def index(self):
+        """Entries of all cycles in the index, the latest entry is used for repeated cycles."""
+        entries = {}
+        file = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(file):
+            with open(file, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry["cycle"]] = entry
+        return [entries[cycle] for cycle in sorted(entries)]
+
+    def cycles(self):
+        return [entry["cycle"] for entry in self.index()]
+
+    def names(self, cycle=None):
+        """Names of DRESPs in cycle, default: last cycle."""
+        entries = self.index()
+        if cycle is not None:
+            entries = [entry for entry in entries if entry["cycle"] == cycle]
+        return entries[-1]["names"]
+
+    def load(self, cycle, keys=None, mmap_mode="r"):
+        """Return dict of memory-mapped arrays of cycle, all arrays if keys is None."""
+        entries = [entry for entry in self.index() if entry["cycle"] == cycle]
+        if not entries:
+            raise KeyError("Cycle {} not found in history {}.".format(cycle, self.directory))
+        cycle_dir = os.path.join(self.directory, entries[-1]["directory"])
+        if keys is None:
+            keys = [f[:-4] for f in os.listdir(cycle_dir) if f.endswith(".npy")]
+        return {key: np.load(os.path.join(cycle_dir, key + ".npy"), mmap_mode=mmap_mode) for key in keys}
+
+    def series(self, key):
+        """Stack array key of all cycles, e.g. "objective" as array of shape (cycles x DRESPs)."""
+        return np.stack([self.load(cycle, [key])[key] for cycle in self.cycles()])
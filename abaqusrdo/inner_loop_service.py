@@ -0,0 +1,221 @@
+# Long-lived service for the inner loop and thin client for the Tosca driver hook.
+# The service keeps the interpreter, NumPy, the config and the covariance warm
+# across cycles, so a cycle does not start a new Python process. The client is
+# called with the same arguments as run_inner_loop.py, forwards them to the
+# service over a local socket and prints the output of the cycle to TOSCA.OUT.
+# If no service is running, the client runs the cycle itself.
+#
+#   python inner_loop_service.py serve -id <input_dir>
+#   python inner_loop_service.py -sd <script_dir> -id <input_dir> -j <job> -c <cycle>
+#   python inner_loop_service.py stop -id <input_dir>
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import sys
+import json
+import argparse
+import threading
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# --------------------------------------------------------------------#
+# Name of file with address of service written to input dir
+ADDRESS_FILE = "inner_loop_service.json"
+
+
+# --------------------------------------------------------------------#
+def get_address_file(input_dir):
+    return os.path.join(input_dir.strip('"'), ADDRESS_FILE)
+
+
+def write_address(input_dir, address, authkey):
+    """Write address and key of service, readable by the current user only."""
+    file = get_address_file(input_dir)
+    fd = os.open(file + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"host": address[0], "port": address[1], "authkey": authkey.hex(), "pid": os.getpid()}, f)
+    os.replace(file + ".tmp", file)
+
+
+def connect(input_dir):
+    """Connect to service of input dir, None if no service is running."""
+    try:
+        with open(get_address_file(input_dir), "r") as f:
+            address = json.load(f)
+        return Client((address["host"], address["port"]), authkey=bytes.fromhex(address["authkey"]))
+    except (OSError, ValueError, KeyError, AuthenticationError):
+        return None
+
+
+class ConnectionWriter(object):
+    """File-like object sending everything printed during a cycle to the client."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        if text:
+            with self.lock:
+                self.conn.send(("output", text))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def is_valid(request):
+    """True if request is a stop request or a run request with arguments and working dir."""
+    if not isinstance(request, dict) or request.get("command") not in ("run", "stop"):
+        return False
+    if request["command"] == "stop":
+        return True
+    argv = request.get("argv")
+    return isinstance(argv, list) and all(isinstance(a, str) for a in argv) and isinstance(request.get("cwd"), str)
+
+
+class InnerLoopService(object):
+    """Service running cycles of the inner loop one after another in this process.
+    The config of an input dir is loaded once and reloaded only if config_rdo.py changed.
+    """
+
+    def __init__(self, input_dir, host="localhost", port=0):
+        self.input_dir = input_dir.strip('"')
+        self.authkey = os.urandom(32)
+        self.listener = Listener((host, port), authkey=self.authkey)
+        self.configs = {}
+
+        # imported once, kept warm for all cycles
+        import run_inner_loop
+
+        self.run_inner_loop = run_inner_loop
+
+    def get_config(self, input_dir):
+        """Return config_rdo module of input dir, reloaded if the file changed."""
+        import importlib.util
+
+        file = os.path.join(input_dir, "config_rdo.py")
+        mtime = os.stat(file).st_mtime_ns
+        if file in self.configs and self.configs[file][0] == mtime:
+            return self.configs[file][1]
+        if input_dir not in sys.path:
+            sys.path.append(input_dir)
+        spec = importlib.util.spec_from_file_location("config_rdo", file)
+        cfg = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cfg)
+        self.configs[file] = (mtime, cfg)
+        return cfg
+
+    def run_cycle(self, conn, argv, cwd):
+        """Run cycle with arguments of run_inner_loop.py and send its output to the client."""
+        import utils
+
+        stdout, stderr, working_dir = sys.stdout, sys.stderr, os.getcwd()
+        sys.stdout = sys.stderr = ConnectionWriter(conn)
+        returncode = 0
+        try:
+            os.chdir(cwd)
+            args = utils.get_arguments(argv)
+            self.run_inner_loop.main(args, self.get_config(args.input_dir.strip('"')))
+        except SystemExit as e:
+            returncode = 0 if e.code is None else e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            os.chdir(working_dir)
+        return returncode
+
+    def serve(self):
+        """Accept requests until a stop request is received."""
+        write_address(self.input_dir, self.listener.address, self.authkey)
+        print("Inner loop service for {} listening on {}:{}.".format(self.input_dir, *self.listener.address))
+        sys.stdout.flush()
+        try:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except (OSError, EOFError, AuthenticationError):  # e.g. client with wrong key
+                    continue
+                try:
+                    with conn:
+                        request = conn.recv()
+                        if not is_valid(request):
+                            print("Rejected malformed request {!r}.".format(request))
+                            sys.stdout.flush()
+                            conn.send(("output", "Malformed request to inner loop service.\n"))
+                            conn.send(("exit", 2))
+                            continue
+                        if request["command"] == "stop":
+                            conn.send(("exit", 0))
+                            break
+                        returncode = self.run_cycle(conn, request["argv"], request["cwd"])
+                        print("Finished request {} with exit status {}.".format(request["argv"], returncode))
+                        sys.stdout.flush()
+                        conn.send(("exit", returncode))
+                except (EOFError, OSError):  # client disconnected or was killed
+                    print("Client disconnected.")
+                    sys.stdout.flush()
+                    continue
+        finally:
+            self.listener.close()
+            if os.path.exists(get_address_file(self.input_dir)):
+                os.remove(get_address_file(self.input_dir))
+
+
+def request(conn, message):
+    """Send request to service and print its output. Returns exit status."""
+    with conn:
+        conn.send(message)
+        while True:
+            kind, value = conn.recv()
+            if kind == "exit":
+                return value
+            sys.stdout.write(value)
+            sys.stdout.flush()
+
+
+# --------------------------------------------------------------------#
+def get_arguments(argv):
+    ap = argparse.ArgumentParser(description="Long-lived service for the inner loop.")
+    ap.add_argument("command", choices=["serve", "stop"])
+    ap.add_argument("-id", "--input_dir", type=str, required=True, help="Path of Abaqus/Tosca-inputfiles")
+    ap.add_argument("--port", type=int, default=0, help="Port on localhost, default: any free port")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in ("serve", "stop"):
+        args = get_arguments(argv)
+        if args.command == "serve":
+            InnerLoopService(args.input_dir, port=args.port).serve()
+            return 0
+        conn = connect(args.input_dir)
+        if conn is None:
+            print("No inner loop service running for {}.".format(args.input_dir))
+            return 1
+        return request(conn, {"command": "stop"})
+
+    # client, called with the arguments of run_inner_loop.py
+    ap = argparse.ArgumentParser(add_help=False)
+    ap.add_argument("-id", "--input_dir", type=str, default=".")
+    conn = connect(ap.parse_known_args(argv)[0].input_dir)
+    if conn is not None:
+        return request(conn, {"command": "run", "argv": argv, "cwd": os.getcwd()})
+
+    print("No inner loop service running, starting inner loop in this process.", flush=True)
+    import run_inner_loop
+    import utils
+
+    run_inner_loop.main(utils.get_arguments(argv))
+    return 0
+
+
+# --------------------------------------------------------------------#
+# Execution as main
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# Module to inject the RV values of each finite difference run into the input deck.
+# RVs are tagged in <job>.inp by the placeholders <rv_1>, <rv_2>, ..., the same
+# names as in the *PARAMETER overlay rv_parameters.inp. The deck is scanned once
+# for the byte offsets of all placeholders. The index is cached across cycles as
+# long as the deck does not change. The deck of each run is written as a stream of
+# unchanged byte ranges of the memory-mapped deck and the formatted RV values.
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import re
+import mmap
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+# --------------------------------------------------------------------#
+PLACEHOLDER_PATTERN = re.compile(rb"<rv_(\d+)>", re.IGNORECASE)
+
+
+# --------------------------------------------------------------------#
+def get_signature(deck):
+    """Size and modification time identifying the version of the deck."""
+    stat = os.stat(deck)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_index(deck):
+    """Return list of (start, end, RV index) of all placeholders in deck, RV index from 0."""
+    if os.path.getsize(deck) == 0:
+        return []
+    with open(deck, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return [(m.start(), m.end(), int(m.group(1)) - 1) for m in PLACEHOLDER_PATTERN.finditer(buffer)]
+
+
+def get_index(deck, cache_file=None, verbose=False):
+    """Index of placeholders in deck, read from cache_file if the deck did not change."""
+    signature = get_signature(deck)
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+            if cached["deck"] == os.path.abspath(deck) and cached["signature"] == signature:
+                return [tuple(entry) for entry in cached["index"]]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = build_index(deck)
+    if verbose:
+        print("Indexed {} RV placeholders in {}.".format(len(index), deck))
+    if cache_file is not None:
+        with open(cache_file + ".tmp", "w") as f:
+            json.dump({"deck": os.path.abspath(deck), "signature": signature, "index": index}, f)
+        os.replace(cache_file + ".tmp", cache_file)
+    return index
+
+
+def write_deck(deck, index, dst, rv_values, value_format="{:.15E}", chunk_size=2**26):
+    """Write deck to dst with placeholders replaced by rv_values."""
+    for _, _, rv in index:
+        if rv < 0 or rv >= len(rv_values):
+            raise ValueError("Placeholder <rv_{:d}> in {} exceeds number of RVs.".format(rv + 1, deck))
+    with open(deck, "rb") as f, open(dst, "wb") as out:
+        if os.path.getsize(deck) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            view = memoryview(buffer)
+            position = 0
+            for start, end, rv in index + [(len(buffer), len(buffer), None)]:
+                for offset in range(position, start, chunk_size):
+                    out.write(view[offset : min(offset + chunk_size, start)])
+                if rv is not None:
+                    out.write(value_format.format(rv_values[rv]).encode())
+                position = end
+            view.release()
+
+
+def write_decks(deck, index, run_dirs, rv_values, number_of_workers=1):
+    """Write perturbed deck to every run directory in parallel."""
+    dst = [os.path.join(run_dir, os.path.basename(deck)) for run_dir in run_dirs]
+    with ThreadPoolExecutor(max_workers=max(1, int(number_of_workers))) as executor:
+        list(executor.map(lambda args: write_deck(deck, index, *args), zip(dst, rv_values)))
+    return dst
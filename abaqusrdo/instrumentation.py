@@ -0,0 +1,168 @@
+# Module to record time and resources of the phases of an inner loop cycle, e.g.
+# setup of directories, solver runs, reading results and writing output.
+# For every phase, wall time, cpu time of the process and its solver
+# subprocesses, change of the resident set size (RSS) during the phase, max. RSS
+# of the process so far and bytes read/written are recorded.
+# Records are appended to a JSON-lines log per job and summarized in TOSCA.OUT.
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+# --------------------------------------------------------------------#
+def get_rss():
+    """Current resident set size of process in bytes, None if not available (linux only)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_max_rss():
+    """Max. resident set size of process so far in bytes, None if not available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_io():
+    """Bytes read and written by process so far, (None, None) if not available (linux only)."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(":") for line in f if ":" in line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+class Instrumentation(object):
+    """Records phases of an inner loop cycle. Phases with the same name are accumulated,
+    e.g. when processing DRESPs one after another. Durations of finite difference runs
+    are added with record_runs(). Call finish() at the end of the cycle to write the
+    records to log_file and print a summary table.
+    """
+
+    def __init__(self, log_file=None, job=None, cycle=None, enabled=True):
+        self.log_file = log_file
+        self.job = job
+        self.cycle = cycle
+        self.enabled = enabled
+        self.phases = {}
+        self.runs = []
+
+    def _snapshot(self):
+        times = os.times()
+        bytes_read, bytes_written = get_io()
+        return {
+            "wall_time": time.perf_counter(),
+            "cpu_time": times[0] + times[1],
+            "children_cpu_time": times[2] + times[3],
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "rss_change": get_rss(),
+        }
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager recording the resources of the enclosed phase."""
+        if not self.enabled:
+            yield
+            return
+        start = self._snapshot()
+        try:
+            yield
+        finally:
+            end = self._snapshot()
+            record = self.phases.setdefault(name, {"phase": name, "calls": 0})
+            record["calls"] += 1
+            for key in start:
+                # None only if no call of the phase could be measured
+                value = difference(end[key], start[key])
+                if value is not None:
+                    record[key] = (record.get(key) or 0) + value
+                else:
+                    record.setdefault(key, None)
+            record["max_rss"] = get_max_rss()  # of the whole process so far, not of the phase
+
+    def record_runs(self, results):
+        """Add durations and exit status of finite difference runs (executors.RunResult)."""
+        if not self.enabled or results is None:
+            return
+        for result in results:
+            self.runs.append(
+                {
+                    "run": result.run,
+                    "duration": result.duration,
+                    "returncode": result.returncode,
+                    "attempts": result.attempts,
+                }
+            )
+
+    def finish(self):
+        """Write records of cycle to log file and print summary."""
+        if not self.enabled:
+            return
+        if self.log_file is not None:
+            with open(self.log_file, "a") as f:
+                for record in self.phases.values():
+                    f.write(json.dumps(dict(record, type="phase", job=self.job, cycle=self.cycle)) + "\n")
+                for record in self.runs:
+                    f.write(json.dumps(dict(record, type="run", job=self.job, cycle=self.cycle)) + "\n")
+        self.summary()
+
+    def summary(self):
+        """Print table of all phases and runs of the cycle to TOSCA.OUT."""
+
+        def fmt(value, scale=1.0, width=12):
+            return "{:>{}}".format("-", width) if value is None else "{:>{}.2f}".format(value / scale, width)
+
+        print("Resources of inner loop cycle {}:".format(self.cycle))
+        print(
+            "{:<24}{:>12}{:>12}{:>12}{:>12}{:>12}{:>12}{:>22}".format(
+                "phase",
+                "wall [s]",
+                "cpu [s]",
+                "solver [s]",
+                "read [MB]",
+                "write [MB]",
+                "RSS + [MB]",
+                "max. RSS so far [MB]",
+            )
+        )
+        for record in self.phases.values():
+            print(
+                "{:<24}".format(record["phase"])
+                + fmt(record["wall_time"])
+                + fmt(record["cpu_time"])
+                + fmt(record["children_cpu_time"])
+                + fmt(record["bytes_read"], 2**20)
+                + fmt(record["bytes_written"], 2**20)
+                + fmt(record["rss_change"], 2**20)
+                + fmt(record["max_rss"], 2**20, 22)
+            )
+        if self.runs:
+            durations = [run["duration"] for run in self.runs]
+            print(
+                "Finite difference runs: {:d}, duration min/mean/max {:.1f}/{:.1f}/{:.1f} s".format(
+                    len(durations), min(durations), sum(durations) / len(durations), max(durations)
+                )
+            )
+        sys.stdout.flush()
@@ -0,0 +1,98 @@
+# Module to read sensitivities from ONF files written by Tosca, e.g. TP_SENS_000.onf.
+# Each file is parsed once: the byte offsets of all sensitivity blocks are
+# indexed first and the values of each block are then converted to a float
+# array in bulk, without creating Python objects per line.
+# --------------------------------------------------------------------#
+# Imports
+
+import mmap
+import re
+import numpy as np
+
+# --------------------------------------------------------------------#
+# Header lines of sensitivity blocks, e.g. OBJ_FUNC_SENSITIVITY, CONSTRAINT_SENSITIVITY_<name>
+HEADER_PATTERN = re.compile(rb"^[^\n]*\b(?:OBJ_FUNC_SENSITIVITY|CONSTRAINT_SENSITIVITY_\S+)[^\n]*$", re.M)
+NEWLINE = ord("\n")
+TO_SEPARATOR = bytes.maketrans(b"\r\n", b" ,")
+
+
+# --------------------------------------------------------------------#
+def index_blocks(buffer):
+    """Index all sensitivity blocks in buffer (bytes or mmap of an ONF file).
+    A block consists of a header line, a line with the number of entries and one
+    line "<id>, <value>[, ...]" per entry. Lines with a block keyword which are not
+    followed by the number of entries, e.g. comments, are skipped. Returns list of
+    tuples (header, number_of_entries, data_start, data_end) with byte offsets.
+    """
+    headers = []  # (match, number_of_entries, end of line with number of entries)
+    for match in HEADER_PATTERN.finditer(buffer):
+        count_start = match.end() + 1
+        count_end = buffer.find(b"\n", count_start)
+        if count_end < 0:
+            count_end = len(buffer)
+        try:
+            headers.append((match, int(buffer[count_start:count_end]), count_end))
+        except ValueError:
+            continue
+    blocks = []
+    for num, (match, number_of_entries, count_end) in enumerate(headers):
+        region_end = headers[num + 1][0].start() if num + 1 < len(headers) else len(buffer)
+        data_start = min(count_end + 1, region_end)
+
+        if data_start < region_end:
+            region = np.frombuffer(buffer, dtype=np.uint8, count=region_end - data_start, offset=data_start)
+            newlines = np.flatnonzero(region == NEWLINE)
+            del region  # release buffer export before mmap is closed
+        else:
+            newlines = []
+        if number_of_entries == 0:
+            data_end = data_start
+        elif len(newlines) >= number_of_entries:
+            data_end = data_start + int(newlines[number_of_entries - 1]) + 1
+        else:
+            data_end = region_end
+
+        header = match.group(0).decode().strip()
+        blocks.append((header, number_of_entries, data_start, data_end))
+    return blocks
+
+
+def read_block(buffer, number_of_entries, data_start, data_end):
+    """Convert the lines "<id>, <value>[, ...]" of a block to a float array of values, the
+    second column. The number of columns is taken from the first line of the block."""
+    line_end = buffer.find(b"\n", data_start, data_end)
+    first_line = buffer[data_start : line_end if line_end >= 0 else data_end]
+    columns = len(first_line.strip(b"\r\n, ").split(b","))
+    if number_of_entries and columns < 2:
+        raise ValueError("Expected lines <id>, <value> in ONF block but found {!r}.".format(first_line))
+    data = buffer[data_start:data_end].translate(TO_SEPARATOR).rstrip(b", ")
+    values = np.fromstring(data, dtype=float, sep=",") if data else np.zeros(0)
+    if values.size != columns * number_of_entries:
+        raise ValueError(
+            "Expected {} entries with {} columns in ONF block but found {} values.".format(
+                number_of_entries, columns, values.size
+            )
+        )
+    return values.reshape(-1, columns)[:, 1].copy() if number_of_entries else np.zeros(0)
+
+
+def read_sensitivities(path):
+    """Read all sensitivity blocks of ONF file at path.
+    Returns dict with header of each block as key and array of values.
+    """
+    sensitivities = {}
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return sensitivities
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for header, number_of_entries, data_start, data_end in index_blocks(buffer):
+                sensitivities[header] = read_block(buffer, number_of_entries, data_start, data_end)
+    return sensitivities
+
+
+def find_block(sensitivities, name):
+    """Return values of the first block whose header contains name."""
+    for header, values in sensitivities.items():
+        if name in header:
+            return values
+    raise KeyError("Sensitivity block {} not found.".format(name))
@@ -0,0 +1,123 @@
+# Library interface of the post-processing of the inner loop without command line
+# arguments, config_rdo.py or files. RVs, covariance and kappa are passed as objects,
+# the values and sensitivities of all finite difference runs as NumPy arrays, and
+# mean, sigma, robust objective and their derivatives w.r.t. the DVs are returned
+# in memory. Reading the runs of a cycle and writing the output for Tosca are
+# optional adapters, so many evaluations can be done in one process:
+#
+#   list_RV = rdo_api.get_random_variables([100, 100], [1000, 900], [1500, 1500])
+#   cov = rdo_api.get_covariance(list_RV, {"pairs": [(0, 1, 0.5)]})
+#   result = rdo_api.evaluate(values, sensitivities, list_RV, cov, kappa=1)
+#   result.objective, result.dObjective_dDV
+# --------------------------------------------------------------------#
+# Imports
+
+import numpy as np
+import utils
+import calculate_derivatives as cd
+
+
+# --------------------------------------------------------------------#
+def get_random_variables(mean, sigma, delta, use_central_differences=False):
+    """Create RV objects from the mean, sigma and delta of every RV."""
+    if not len(mean) == len(sigma) == len(delta):
+        raise ValueError("Mean, sigma and delta have to be given for every RV.")
+    return [cd.RV(i, mean[i], sigma[i], delta[i], use_central_differences) for i in range(len(mean))]
+
+
+def get_covariance(list_RV, correlation=None):
+    """Covariance of the RVs, correlation as in get_correlation() of calculate_derivatives.py."""
+    return cd.get_covariance(list_RV, False, correlation)
+
+
+def get_number_of_runs(list_step):
+    """Number of finite difference runs incl. the mean run for RVs or directions list_step."""
+    runs_per_step = 2 if list_step and list_step[0].use_central_differences else 1
+    return 1 + runs_per_step * len(list_step)
+
+
+def evaluate(
+    values,
+    sensitivities,
+    list_RV,
+    cov,
+    kappa,
+    names=None,
+    directions=None,
+    number_of_workers=1,
+    dtype=float,
+    chunk_size=None,
+    active_dvs=None,
+):
+    """Calculate derivatives w.r.t. RVs, mean, sigma and robust objective incl. derivatives
+    w.r.t. DVs for all DRESPs. Runs are ordered as the run directories of a cycle.
+    Input:  values:         DRESP values of all runs, runs x DRESPs
+            sensitivities:  sensitivities of all runs, runs x DRESPs x DVs
+            cov:            Covariance object or covariance matrix of the RVs
+            directions:     e.g. EigenDirections, if the runs are along directions
+            active_dvs:     index array of DVs kept or "auto" for DVs with non-zero sensitivity
+    Returns DrespBatch holding the results as arrays, e.g. objective (DRESPs) and
+    dObjective_dDV (DRESPs x active DVs, indices in dv_index if not all DVs are active).
+    """
+    values = np.asarray(values, dtype=float)
+    sensitivities = np.asarray(sensitivities)
+    if values.ndim == 1:
+        values = values[:, None]  # single DRESP
+    if sensitivities.ndim == 2:
+        sensitivities = sensitivities[:, None]
+    if sensitivities.shape[:2] != values.shape:
+        raise ValueError(
+            "Sensitivities of shape {} do not match values of shape {}.".format(sensitivities.shape, values.shape)
+        )
+    list_step = directions.list_direction if directions is not None else list_RV
+    if values.shape[0] != get_number_of_runs(list_step):
+        raise ValueError(
+            "Expected {:d} finite difference runs, got {:d}.".format(get_number_of_runs(list_step), values.shape[0])
+        )
+    if names is None:
+        names = ["DRESP_{:d}".format(d + 1) for d in range(values.shape[1])]
+    if not isinstance(cov, cd.Covariance):
+        cov = cd.Covariance(cov)
+    if isinstance(active_dvs, str):
+        active_dvs = np.flatnonzero(np.any(sensitivities != 0, axis=(0, 1)))
+
+    batch = cd.DrespBatch(
+        names, list_step, number_of_workers, directions, dtype, chunk_size=chunk_size, active_dvs=active_dvs
+    )
+    batch.numberOfDV = sensitivities.shape[2]
+    batch.set_active_dvs([], [])
+    batch.value = values
+    batch.dDV = batch.allocate("dDV", sensitivities.shape[:2] + (batch.numberOfActiveDV,))
+    batch.dDV[...] = sensitivities if batch.dv_index is None else sensitivities[:, :, batch.dv_index]
+    batch.calculate(cov, float(kappa))
+    return batch
+
+
+# --------------------------------------------------------------------#
+# Adapters for files of the inner loop
+def read_cycle(tosca_dirs, number_of_workers=1, cache=None):
+    """Read the runs tosca_dirs/run_XXX of a cycle. Returns the names of the DRESPs without
+    VOL and MASS, their values (runs x DRESPs) and sensitivities (runs x DRESPs x DVs)."""
+    resultsDRESP, resultsSENS = cd.get_results(tosca_dirs, True, number_of_workers, cache)  # files are kept
+    if not resultsDRESP:
+        raise ValueError("No finite difference runs found in {}.".format(tosca_dirs))
+    names = [name for name in utils.read_names(resultsDRESP[0]) if "VOL" not in name if "MASS" not in name]
+    batch = cd.DrespBatch(names, [])
+    batch.find_values(resultsDRESP)
+    batch.find_sensitivities(resultsSENS)
+    return names, batch.value, batch.dDV
+
+
+def write_output(result, dst, use_central_differences=None, cycle=None, kappa=None, verbose=False):
+    """Write DRESP_<name>.onf of all DRESPs of result from evaluate() to dst, as read by the
+    outer loop. With cycle, the status of all DRESPs is appended to DRESP_status_all.csv in dst.
+    use_central_differences overrides the scheme of the RVs of result. Returns the DRESPs as
+    list of Dresp objects."""
+    if use_central_differences is None:
+        use_central_differences = bool(result.list_RV) and result.list_RV[0].use_central_differences
+    list_DRESP = result.to_dresps()
+    for dresp in list_DRESP:
+        dresp.write_output(dst, use_central_differences=use_central_differences, verbose=verbose)
+    if cycle is not None:
+        cd.write_status(dst, list_DRESP, cycle, kappa)
+    return list_DRESP
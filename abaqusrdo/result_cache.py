@@ -0,0 +1,158 @@
+# Module for a content-addressed cache of finite difference results.
+# Results of a run are identified by a hash of the job files (input deck,
+# distribution of the design variables, ...) and the values of the RVs of
+# the run. Runs with a known key do not have to be solved again, e.g. for
+# RVs with delta = 0 or when the design did not change between cycles.
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import hashlib
+import numpy as np
+
+# --------------------------------------------------------------------#
+# Name of file with cache key written to run directories
+KEY_FILE = "result_cache.key"
+
+
+# --------------------------------------------------------------------#
+def hash_files(files, chunk_size=2**20):
+    """Hash contents of all files, missing files are skipped. Returns hash object."""
+    digest = hashlib.sha256()
+    for file in files:
+        if not os.path.exists(file):
+            continue
+        digest.update(os.path.basename(file).encode())
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    return digest
+
+
+def get_keys(files, rv_values, extra=""):
+    """Cache keys for all runs. Files are hashed once and combined with the RV
+    values of each run, so runs with identical RV values share their key.
+    """
+    base = hash_files(files)
+    base.update(extra.encode())
+    keys = []
+    for values in rv_values:
+        digest = base.copy()
+        digest.update(",".join(repr(float(value)) for value in values).encode())
+        keys.append(digest.hexdigest())
+    return keys
+
+
+def write_key(run_dir, key):
+    with open(os.path.join(run_dir, KEY_FILE), "w") as f:
+        f.write(key)
+
+
+def read_key(run_dir):
+    """Return cache key of run directory or None if not available."""
+    file = os.path.join(run_dir, KEY_FILE)
+    if not os.path.exists(file):
+        return None
+    with open(file, "r") as f:
+        return f.read().strip()
+
+
+def from_config(cfg, input_dir):
+    """Create result cache from settings in config_rdo.py, None if not configured."""
+    directory = getattr(cfg, "result_cache_dir", None)
+    if not directory:
+        return None
+    return ResultCache(
+        os.path.join(input_dir, directory),
+        getattr(cfg, "result_cache_size", None),
+        getattr(cfg, "result_cache_entries", None),
+        cfg.verbose,
+    )
+
+
+class ResultCache(object):
+    """Cache of DRESP values and sensitivity arrays of finite difference runs.
+    Every entry is stored as uncompressed .npz file named by its key. Least recently
+    used entries are evicted once max_entries or max_size (bytes) are exceeded.
+    """
+
+    def __init__(self, directory, max_size=None, max_entries=None, verbose=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.verbose = verbose
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def __contains__(self, key):
+        return key is not None and os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Return (status rows, sensitivities) of run for key or None."""
+        if key not in self:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                status = [data["status_header"].tolist(), data["status_values"].tolist()]
+                sensitivities = {
+                    str(name): data["sens_{:d}".format(i)] for i, name in enumerate(data["sens_names"])
+                }
+        except (OSError, ValueError, KeyError):
+            return None
+        self.touch(key)
+        return status, sensitivities
+
+    def touch(self, key):
+        """Mark entry as recently used."""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def put(self, key, status, sensitivities):
+        """Store status rows and sensitivities of run under key and evict old entries."""
+        arrays = {
+            "status_header": np.asarray(status[0], dtype=str),
+            "status_values": np.asarray(status[-1], dtype=str),
+            "sens_names": np.asarray(list(sensitivities.keys()), dtype=str),
+        }
+        for i, values in enumerate(sensitivities.values()):
+            arrays["sens_{:d}".format(i)] = np.asarray(values)
+
+        path = self._path(key)
+        tmp_path = path + ".{:d}.tmp".format(os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries exceeding max_entries or max_size."""
+        if self.max_size is None and self.max_entries is None:
+            return
+        entries = []
+        for file in os.listdir(self.directory):
+            if file.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, file))
+                except OSError:  # removed by concurrent eviction
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file))
+        entries.sort(reverse=True)
+
+        total_size = 0
+        for num, (_, size, file) in enumerate(entries):
+            total_size += size
+            if (self.max_entries is not None and num >= self.max_entries) or (
+                self.max_size is not None and total_size > self.max_size and num > 0
+            ):
+                try:
+                    os.remove(os.path.join(self.directory, file))
+                except OSError:
+                    continue
+                if self.verbose:
+                    print("Removed {} from result cache.".format(file))
@@ -12,6 +12,12 @@ import utils
 import subprocess as sp
 
 import calculate_derivatives as cd
+import executors
+import checkpoint
+import input_deck
+import workspace_gc
+import result_cache
+from instrumentation import Instrumentation
 
 
 # --------------------------------------------------------------------#
@@ -24,16 +30,35 @@ def create_dir(path, verbose):
             print("Successfully created directory {}".format(path))
 
 
+def stage_file(src, dst_dir, mode="copy"):
+    """Place file src in dst_dir as copy, hardlink or symlink. Links fall back to a copy
+    where they are not supported, e.g. hardlinks across file systems. Returns mode used."""
+    dst = os.path.join(dst_dir, os.path.basename(src))
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+            return mode
+        if mode == "symlink":
+            os.symlink(os.path.abspath(src), dst)
+            return mode
+    except (OSError, NotImplementedError):
+        pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
 def move_results(src, dst, verbose=False):
     """Move results from result dir to parent Tosca work dir."""
     print("Moving files containing DRESPs and sensitvities to Tosca work dir.", flush=True)
     result_files = glob.glob(os.path.join(src, "DRESP_*.onf"))
     for rf in result_files:
-        dst = os.path.join(dst, os.path.split(rf)[1])
+        dst_file = os.path.join(dst, os.path.split(rf)[1])
         if verbose:
-            shutil.copy2(rf, dst)
+            shutil.copy2(rf, dst_file)
         else:
-            shutil.move(rf, dst)
+            shutil.move(rf, dst_file)
 
 
 def clean_input_dir(dir):
@@ -70,8 +95,14 @@ class IsightJob:
         run_on_windows,
         cycle,
         verbose,
+        rv_values=None,
+        instrumentation=None,
+        collector=None,
     ):
-        """Create job-object for Isight loop."""
+        """Create job-object for Isight loop. Pass rv_values to define the values of
+        the RVs per run instead of finite differences w.r.t. every RV. Directories of
+        previous cycles are removed by collector (workspace_gc.WorkspaceCollector),
+        by default only the current cycle is kept, or all cycles in verbose mode."""
         self.job_name = job_name
         self.number_of_rv = int(number_of_rv)
         self.mean_rv = mean_rv
@@ -83,10 +114,16 @@ class IsightJob:
         self.use_central_differences = use_central_differences
         self.run_on_windows = run_on_windows
 
+        self.rv_values = rv_values
+        self.collector = collector
+
         self.cycle = cycle
-        self._setup_directories(input_dir, script_dir, tosca_work_dir)
-        self._clean_input()
-        self._clean_inner_loop()
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
+        with self.instrumentation.phase("setup_directories"):
+            self._setup_directories(input_dir, script_dir, tosca_work_dir)
+        with self.instrumentation.phase("cleanup"):
+            self._clean_input()
+            self._clean_inner_loop()
 
     def _setup_directories(self, input_dir, script_dir, tosca_work_dir):
         """Setup of directories for current Isight-run."""
@@ -112,7 +149,9 @@ class IsightJob:
 
         self.runtime_dir = []
 
-        if self.use_central_differences:
+        if self.rv_values is not None:
+            total_runs = len(self.rv_values)
+        elif self.use_central_differences:
             total_runs = 2 * self.number_of_rv + 1
         else:
             total_runs = self.number_of_rv + 1
@@ -130,15 +169,14 @@ class IsightJob:
             os.remove(file)
 
     def _clean_inner_loop(self):
-        """Delete previous directory in subdirectory inner_loop."""
-        if self.verbose:
-            print("Running in verbose mode, keeping all directories in inner_loop.")
-        elif not self.verbose and self.cycle > 1:
-            previous_dir = os.path.join(
-                self.isight_root_dir,
-                self.job_name + "_{:03d}".format((int(self.cycle) - 1)),
+        """Remove directories of previous cycles in subdirectory inner_loop in the background."""
+        if self.collector is None:
+            self.collector = workspace_gc.WorkspaceCollector(
+                self.isight_root_dir, self.job_name, keep_last=None if self.verbose else 1, verbose=self.verbose
             )
-            shutil.rmtree(previous_dir)
+        if self.verbose and self.collector.keep_last is None:
+            print("Running in verbose mode, keeping all directories in inner_loop.")
+        self.collector.collect(int(self.cycle))
 
     def info(self):
         """Display job attributes in terminal -> TOSCA.OUT."""
@@ -187,51 +225,271 @@ class IsightJob:
         if self.verbose:
             print(complete_isight_call, flush=True)
 
-        cp = sp.run(complete_isight_call, shell=True, check=True)
+        with self.instrumentation.phase("solver"):
+            cp = sp.run(complete_isight_call, shell=True, check=True)
         # self._move_results()
 
+    def get_job_files(self, run_files):
+        """Paths of job files from input dir and distribution from Tosca work dir."""
+        files = [os.path.join(self.input_dir, f.format(job=self.job_name)) for f in run_files]
+        files.append(os.path.join(self.tosca_work_dir, "tosca_distribution.txt"))
+        return files
+
+    def stage_files(self, run_files, runs=None, mode="copy"):
+        """Stage job files from input dir and distribution from Tosca work dir in run directories
+        as copies, hardlinks or symlinks (mode), see stage_file(). Only the run indices in runs
+        are staged if given, otherwise all runs."""
+        if runs is None:
+            runs = range(len(self.runtime_dir))
+        for file in self.get_job_files(run_files):
+            if not os.path.exists(file):
+                if self.verbose:
+                    print("File {} not found, not staged for finite difference runs.".format(file))
+                continue
+            used = set(stage_file(file, self.runtime_dir[run], mode) for run in runs)
+            if mode not in used and used:
+                print("Staging {} as {} not supported, copied to run directories.".format(file, mode))
+        sys.stdout.flush()
+
+    def get_rv_values(self):
+        """Values of the RVs for every run."""
+        if self.rv_values is not None:
+            return self.rv_values
+        return executors.get_rv_values(self.mean_rv, self.delta_rv, self.use_central_differences)
+
+    def prepare_local(self, executor, run_files, cache=None, resume=False):
+        """Compute keys of all runs and return (keys, runs) with the runs which have to be
+        solved. Runs with results in the cache or, with resume, a valid completion marker
+        from a previous attempt of the cycle are skipped."""
+        keys = result_cache.get_keys(self.get_job_files(run_files), self.get_rv_values(), executor.solver_command)
+        runs = []
+        completed = 0
+        for run, (rt_dir, key) in enumerate(zip(self.runtime_dir, keys)):
+            if cache is not None:
+                result_cache.write_key(rt_dir, key)
+                if key in cache:
+                    cache.touch(key)
+                    continue
+            if resume and checkpoint.is_complete(rt_dir, key):
+                completed += 1
+                continue
+            checkpoint.remove_marker(rt_dir)
+            runs.append(run)
+        if resume:
+            print(
+                "Resuming cycle of {}: {} finite difference runs already complete.".format(self.job_name, completed),
+                flush=True,
+            )
+        return keys, runs
+
+    def stage_local(self, runs, run_files, staging="copy", deck=None, number_of_workers=1):
+        """Stage job files in run directories, see stage_files(). If deck (e.g. "{job}.inp")
+        is given, the placeholders <rv_i> in the deck are replaced by the RV values of each
+        run, see input_deck.py."""
+        if deck is not None:
+            deck = deck.format(job=self.job_name)
+            run_files = [f for f in run_files if f.format(job=self.job_name) != deck]
+            deck = os.path.join(self.input_dir, deck)
+            index = input_deck.get_index(
+                deck, os.path.join(self.tosca_work_dir, os.path.basename(deck) + ".rv_index.json"), self.verbose
+            )
+            rv_values = self.get_rv_values()
+            input_deck.write_decks(
+                deck,
+                index,
+                [self.runtime_dir[run] for run in runs],
+                [rv_values[run] for run in runs],
+                number_of_workers,
+            )
+        self.stage_files(run_files, runs, staging)
+
+    def start_local(
+        self, executor, run_files, cache=None, callback=None, resume=False, staging="copy", deck=None
+    ):
+        """Start finite difference runs through a Python executor instead of Isight,
+        see start_local()."""
+        return start_local([self], executor, run_files, cache, [callback], resume, staging, deck)
+
+
+def start_local(jobs, executor, run_files, cache=None, callbacks=None, resume=False, staging="copy", deck=None):
+    """Start finite difference runs of all jobs (e.g. several FE models) in one executor pool.
+    Runs with results already in the cache and, with resume, runs with a valid completion
+    marker are not solved, see IsightJob.prepare_local(). Runs with the same key as a previous
+    run (identical job files and RV values, e.g. delta = 0) are solved once. Without cache,
+    the outputs of the solved run are linked or copied to the other runs.
+    callbacks (one per job) are called by the executor for every run as soon as it is complete.
+    Every successful run gets a completion marker. Job files are staged as given by staging,
+    the RV values of each run are written to a small overlay rv_parameters.inp by the executor.
+    """
+    callbacks = callbacks or [None] * len(jobs)
+    sources = {}  # key -> (job, run) solving the key
+    copies = {}  # (job, run) -> runs receiving the outputs of the solved run
+    tasks = []
+    number_of_runs = 0
+    for job, callback in zip(jobs, callbacks):
+        keys, runs = job.prepare_local(executor, run_files, cache, resume)
+        number_of_runs += len(job.runtime_dir)
+        solve = []
+        for run in runs:
+            if keys[run] not in sources:
+                sources[keys[run]] = (job, run)
+                solve.append(run)
+            elif cache is None:
+                copies.setdefault(sources[keys[run]], []).append((job, run, keys[run], callback))
+        job.stage_local(solve, run_files, staging, deck, executor.concurrency or os.cpu_count() or 1)
+
+        def on_complete(result, job=job, keys=keys, callback=callback):
+            # outputs are passed on before the callback may remove them
+            for other, run, key, other_callback in copies.get((job, result.run), []) if result.success else []:
+                for name in checkpoint.get_output_files(result.run_dir) or []:
+                    stage_file(os.path.join(result.run_dir, name), other.runtime_dir[run], "hardlink")
+                checkpoint.write_marker(other.runtime_dir[run], key)
+                if other_callback is not None:
+                    other_callback(executors.RunResult(run, other.runtime_dir[run], 0, result.log_file, 0.0))
+            if result.success:
+                checkpoint.write_marker(result.run_dir, keys[result.run])
+            if callback is not None:
+                callback(result)
+
+        rv_values = job.get_rv_values()
+        fields = {"job": job.job_name, "input_dir": job.input_dir, "tosca_work_dir": job.tosca_work_dir}
+        tasks += [(run, job.runtime_dir[run], rv_values[run], fields, on_complete) for run in solve]
+    if cache is not None or len(tasks) < number_of_runs:
+        print("Solving {} of {} finite difference runs.".format(len(tasks), number_of_runs), flush=True)
+
+    with jobs[0].instrumentation.phase("solver"):
+        results = executor.run_tasks(tasks)
+    jobs[0].instrumentation.record_runs(results)
+    failed = [result for result in results if not result.success]
+    if failed:
+        raise RuntimeError(
+            "Finite difference runs failed:\n{}".format("\n".join(str(result) for result in failed))
+        )
+    return results
+
 
 # --------------------------------------------------------------------#
-def main():
+def main(args=None, cfg=None):
     # Get arguments from module call
-    args = utils.get_arguments()
+    if not args:
+        args = utils.get_arguments()
 
+    # several FE models may be passed as list, their runs are solved in one pool
+    jobs = utils.get_jobs(args.job)
     input_dir = args.input_dir.strip('"')
     script_dir = args.script_dir.strip('"')
-    tosca_work_dir = os.path.join(input_dir, "{}_RDO".format(args.job))
+    work_dir = args.work_dir.strip('"') if getattr(args, "work_dir", None) else "{}_RDO".format(jobs[0])
+    tosca_work_dir = os.path.join(input_dir, work_dir)
 
     # Get parameters from config file
-    sys.path.append(input_dir)
-    import config_rdo as cfg
+    if not cfg:
+        sys.path.append(input_dir)
+        import config_rdo as cfg
 
-    # Setup Isight job and start
-    job = IsightJob(
-        input_dir,
-        script_dir,
-        tosca_work_dir,
+    # Record time and resources of all phases of the cycle
+    instrumentation = Instrumentation(
+        os.path.join(tosca_work_dir, "inner_loop_resources.jsonl"),
         args.job,
-        cfg.number_of_rv,
-        cfg.mean_rv,
-        cfg.sigma_rv,
-        cfg.delta_rv,
-        cfg.kappa,
-        cfg.use_central_differences,
-        cfg.run_on_windows,
         args.cycle,
-        cfg.verbose,
+        getattr(cfg, "instrumentation", True),
     )
 
-    job.info()
-    job.start()
+    # Executor of the finite difference runs, None for Isight
+    executor = executors.from_config(cfg)
+
+    # Finite differences along eigen directions of the covariance
+    rv_values = None
+    streams = {}
+    list_RV = cd.get_random_variables(cfg)
+    cov = cd.get_covariance(list_RV, False, getattr(cfg, "correlation_rv", None))
+    directions = cd.get_eigen_directions(cfg, cov)
+    reused = getattr(cfg, "rv_screening", None) or getattr(cfg, "broyden", None)
+    if (directions is not None or reused) and executor is None:
+        # checked before the state of RV screening or Broyden update is written
+        raise ValueError(
+            'Eigen directions, RV screening and Broyden update require executor = "local", "slurm" or "pbs".'
+        )
+    reuse = cd.get_reused_derivatives(cfg, list_RV, cov, tosca_work_dir, args.cycle)
+    if reuse is not None:
+        directions = reuse  # runs of frozen RVs are skipped, only probes are solved
+    if directions is not None:
+        rv_values = directions.get_rv_values(cfg.mean_rv)
+    if getattr(cfg, "streaming", False) and executor is None:
+        raise ValueError('Streaming post-processing requires executor = "local", "slurm" or "pbs".')
+    if getattr(cfg, "resume", False) and executor is None:
+        raise ValueError('Resuming a cycle requires executor = "local", "slurm" or "pbs".')
+
+    # Setup Isight job for every FE model and start
+    list_job = [
+        IsightJob(
+            input_dir,
+            script_dir,
+            tosca_work_dir,
+            job_name,
+            cfg.number_of_rv,
+            cfg.mean_rv,
+            cfg.sigma_rv,
+            cfg.delta_rv,
+            cfg.kappa,
+            cfg.use_central_differences,
+            cfg.run_on_windows,
+            args.cycle,
+            cfg.verbose,
+            rv_values,
+            instrumentation,
+            workspace_gc.from_config(cfg, os.path.join(tosca_work_dir, "inner_loop"), job_name),
+        )
+        for job_name in jobs
+    ]
+
+    for job in list_job:
+        job.info()  # directions are printed by calculate_derivatives.py
+    if executor is not None:
+        cache = result_cache.from_config(cfg, input_dir)
+        if getattr(cfg, "streaming", False):
+            # read runs as soon as they are complete
+            for job in list_job:
+                streams[job.job_name] = cd.DrespStream(
+                    job.runtime_dir,
+                    directions.list_direction if directions is not None else list_RV,
+                    getattr(cfg, "number_of_workers", 1),
+                    directions,
+                    cache,
+                    cfg.verbose,
+                    active_dvs=cd.get_active_dvs(cfg, input_dir, job.job_name),
+                    **cd.get_storage(cfg, job.isight_work_dir)
+                )
+        start_local(
+            list_job,
+            executor,
+            getattr(cfg, "run_files", ["{job}.inp", "{job}.par"]),
+            cache,
+            [streams[job.job_name].add_result if streams else None for job in list_job],
+            getattr(cfg, "resume", False),
+            getattr(cfg, "staging", "copy"),
+            getattr(cfg, "rv_deck", None),
+        )
+    else:
+        for job in list_job:
+            job.start()
 
     # Postprocessing of runs for finite differences
     args.input_dir = input_dir
-    args.result_dir = job.result_dir
-    cd.main(args, cfg)
-
-    # Move results from inner loop to tosca work dir
-    move_results(job.result_dir, job.tosca_work_dir)
-    clean_input_dir(input_dir)
+    args.work_dir = work_dir
+    args.result_dir = list_job[0].result_dir if len(list_job) == 1 else None
+    cd.main(args, cfg, instrumentation, streams)
+
+    # Move results of all models from inner loop to tosca work dir
+    with instrumentation.phase("move_results"):
+        for job in list_job:
+            move_results(job.result_dir, job.tosca_work_dir)
+    for job in list_job:
+        workspace_gc.mark_complete(job.isight_work_dir)
+    with instrumentation.phase("cleanup"):
+        clean_input_dir(input_dir)
+        for job in list_job:
+            job.collector.wait()
+    instrumentation.finish()
 
     print(f"Finished inner loop for cycle {args.cycle}.")
 
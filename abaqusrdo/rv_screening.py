@@ -0,0 +1,222 @@
+# Module for the screening of RVs with negligible contribution to the variance of
+# the DRESPs. The contribution of RV i to the FOSM-variance of a DRESP is estimated
+# as dRV_i^2 * cov_ii relative to the sum over all RVs. RVs whose contribution to
+# every DRESP fell below a threshold are frozen: their finite difference runs are
+# skipped and their derivatives from the last cycle they were solved in are reused.
+# All RVs are solved again every refresh_every cycles and if the design changed by
+# more than max_design_change since the last full cycle. The same state of the
+# derivatives w.r.t. RVs is used by the Broyden update of the derivatives, see
+# BroydenDirections in calculate_derivatives.py. The state is kept across cycles in
+# <job>_RDO/rv_screening or <job>_RDO/broyden:
+#
+#   state.json              cycle of last full cycle, contributions of all RVs
+#   plan.json               plan of the current cycle, e.g. frozen RVs or probes
+#   design.npy              DV values of the last full cycle
+#   <model>/names.json      DRESPs and number of DVs of FE model
+#   <model>/dRV.npy         derivatives w.r.t. all RVs, RVs x DRESPs
+#   <model>/dRVdDV.npy      RVs x DRESPs x active DVs in storage dtype, memory-mapped
+#   <model>/dv_index.npy    indices of the active DVs, if not all DVs are active
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import re
+import json
+import numpy as np
+
+# --------------------------------------------------------------------#
+STATE_FILE = "state.json"
+PLAN_FILE = "plan.json"
+DESIGN_FILE = "design.npy"
+ROW_PATTERN = re.compile(r"^\s*\d+\s*[,\s]\s*(.*)$")
+
+
+# --------------------------------------------------------------------#
+def read_design(file):
+    """DV values in distribution table, last number of every row starting with an id.
+    Returns None if the file does not exist."""
+    if not os.path.exists(file):
+        return None
+    values = []
+    with open(file, "r") as f:
+        for line in f:
+            match = ROW_PATTERN.match(line)
+            if match:
+                try:
+                    values.append(float(match.group(1).replace(",", " ").split()[-1]))
+                except (ValueError, IndexError):
+                    continue
+    return np.asarray(values, dtype=float)
+
+
+def get_design_change(design, reference):
+    """Root mean square change of the DV values, inf if the designs are not comparable."""
+    if design is None or reference is None or design.shape != reference.shape or design.size == 0:
+        return np.inf
+    return float(np.sqrt(np.mean((design - reference) ** 2)))
+
+
+def save(file, array):
+    """Save array to .npy, replaced atomically so the previous file may still be memory-mapped."""
+    np.save(file + ".tmp.npy", array)
+    os.replace(file + ".tmp.npy", file)
+
+
+def get_contributions(dRV, variances):
+    """Relative contribution of every RV to the variance of every DRESP, RVs x DRESPs.
+    DRESPs without variance count as fully dependent on every RV."""
+    terms = np.asarray(dRV, dtype=float) ** 2 * np.asarray(variances, dtype=float)[:, None]
+    total = terms.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, terms / total, 1.0)
+
+
+class ScreeningState(object):
+    """Persistent state of the derivatives w.r.t. RVs in directory, see module description."""
+
+    def __init__(self, directory, number_of_rv):
+        self.directory = directory
+        self.number_of_rv = number_of_rv
+        self.state = {}
+        file = os.path.join(directory, STATE_FILE)
+        if os.path.exists(file):
+            with open(file, "r") as f:
+                state = json.load(f)
+            if state.get("number_of_rv") == number_of_rv:  # otherwise start over
+                self.state = state
+        self.stored = {}  # DRESP name -> (dRV, dRVdDV, index, dv_index, number of DVs), loaded on demand
+
+    @property
+    def last_full_cycle(self):
+        return self.state.get("last_full_cycle")
+
+    def get_plan(self, cycle, decide, design=None):
+        """Plan of cycle as dict, decided once by decide() and saved, so it is the same for all
+        calls within the cycle, e.g. when solving and post-processing the runs or resuming the
+        cycle. The design of a full cycle (plan["full"]) is saved as reference."""
+        plan_file = os.path.join(self.directory, PLAN_FILE)
+        if os.path.exists(plan_file):
+            with open(plan_file, "r") as f:
+                plan = json.load(f)
+            if plan["cycle"] == cycle:
+                return plan
+
+        plan = dict(decide(), cycle=int(cycle))
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        if plan["full"] and design is not None:
+            save(os.path.join(self.directory, DESIGN_FILE), design)
+        with open(plan_file + ".tmp", "w") as f:
+            json.dump(plan, f)
+        os.replace(plan_file + ".tmp", plan_file)
+        return plan
+
+    def is_due(self, cycle, refresh_every=None, design=None, max_design_change=None):
+        """True if all RVs have to be solved in cycle: no previous full cycle, refresh_every
+        cycles since the last full cycle or design change above max_design_change."""
+        if self.last_full_cycle is None or "contribution" not in self.state or cycle <= self.last_full_cycle:
+            return True
+        if refresh_every and cycle - self.last_full_cycle >= refresh_every:
+            return True
+        if max_design_change is not None:
+            reference_file = os.path.join(self.directory, DESIGN_FILE)
+            reference = np.load(reference_file) if os.path.exists(reference_file) else None
+            if get_design_change(design, reference) > max_design_change:
+                return True
+        return False
+
+    def get_frozen(self, cycle, threshold, refresh_every=None, design=None, max_design_change=None):
+        """Indices of RVs to be frozen in cycle, empty for a full cycle, see get_plan()."""
+
+        def decide():
+            if self.is_due(cycle, refresh_every, design, max_design_change):
+                return {"full": True, "frozen": []}
+            frozen = [i for i, contribution in enumerate(self.state["contribution"]) if contribution < threshold]
+            return {"full": not frozen, "frozen": frozen}
+
+        return self.get_plan(cycle, decide, design)["frozen"]
+
+    def load(self):
+        """Map the stored derivatives of all DRESPs of all FE models."""
+        self.stored = {}
+        if not os.path.isdir(self.directory):
+            return
+        for model in sorted(os.listdir(self.directory)):
+            names_file = os.path.join(self.directory, model, "names.json")
+            if not os.path.exists(names_file):
+                continue
+            with open(names_file, "r") as f:
+                entry = json.load(f)
+            dRV = np.load(os.path.join(self.directory, model, "dRV.npy"))
+            dRVdDV = np.load(os.path.join(self.directory, model, "dRVdDV.npy"), mmap_mode="r")
+            index_file = os.path.join(self.directory, model, "dv_index.npy")
+            dv_index = np.load(index_file) if os.path.exists(index_file) else None
+            for d, name in enumerate(entry["names"]):
+                self.stored[name] = (dRV, dRVdDV, d, dv_index, entry["number_of_dv"])
+
+    def get(self, name):
+        """Stored (dRV, dRVdDV, index of DRESP, dv_index, number of DVs) of DRESP name, None if unknown."""
+        return self.stored.get(name)
+
+    def get_dRVdDV(self, name, rvs=slice(None), dvs=slice(None)):
+        """Stored derivatives of the sensitivities of DRESP name w.r.t. RVs rvs for the DVs dvs,
+        given as indices or slice in the full layout of all DVs, as array RVs x DVs. DVs not
+        stored, i.e. inactive when stored, are zero."""
+        _, dRVdDV, num, dv_index, number_of_dv = self.stored[name]
+        rvs = np.arange(dRVdDV.shape[0])[rvs]
+        dvs = np.arange(number_of_dv)[dvs]
+        if dv_index is None:
+            return np.asarray(dRVdDV[:, num][np.ix_(rvs, dvs)], dtype=float)
+        position = np.minimum(np.searchsorted(dv_index, dvs), max(len(dv_index) - 1, 0))
+        stored = dv_index[position] == dvs if len(dv_index) else np.zeros(len(dvs), dtype=bool)
+        rows = np.zeros((len(rvs), len(dvs)))
+        rows[:, stored] = dRVdDV[:, num][np.ix_(rvs, position[stored])]
+        return rows
+
+    def store(self, model, list_DRESP):
+        """Save derivatives w.r.t. all RVs of the DRESPs of FE model. dRVdDV is written row by row
+        to a memory-mapped file in the storage dtype and for the active DVs only."""
+        for dresp in list_DRESP:
+            self.stored.pop(dresp.name, None)  # release memory-mapped file before replacing it
+        model_dir = os.path.join(self.directory, model)
+        if not os.path.exists(model_dir):
+            os.makedirs(model_dir)
+        save(
+            os.path.join(model_dir, "dRV.npy"),
+            np.stack([np.asarray(dresp.dRV, dtype=float) for dresp in list_DRESP], axis=1),
+        )
+
+        first = list_DRESP[0]
+        dtype = np.result_type(*[np.asarray(dresp.dObjective_dDV).dtype for dresp in list_DRESP])
+        shape = (len(first.dRVdDV), len(list_DRESP), len(first.dObjective_dDV))
+        file = os.path.join(model_dir, "dRVdDV.npy")
+        dRVdDV = np.lib.format.open_memmap(file + ".tmp.npy", mode="w+", dtype=dtype, shape=shape)
+        for d, dresp in enumerate(list_DRESP):
+            for i, row in enumerate(dresp.dRVdDV):
+                dRVdDV[i, d] = row
+        dRVdDV.flush()
+        del dRVdDV
+        os.replace(file + ".tmp.npy", file)
+        index_file = os.path.join(model_dir, "dv_index.npy")
+        if first.dv_index is not None:
+            save(index_file, np.asarray(first.dv_index))
+        elif os.path.exists(index_file):
+            os.remove(index_file)
+
+        with open(os.path.join(model_dir, "names.json"), "w") as f:
+            json.dump({"names": [dresp.name for dresp in list_DRESP], "number_of_dv": int(first.numberOfDV)}, f)
+
+    def update(self, cycle, list_DRESP, variances, full, **entries):
+        """Record contributions of all RVs after cycle, the maximum over all DRESPs, and
+        further entries, e.g. the frozen RVs."""
+        contribution = get_contributions(np.stack([dresp.dRV for dresp in list_DRESP], axis=1), variances)
+        self.state = dict(
+            entries,
+            number_of_rv=self.number_of_rv,
+            cycle=int(cycle),
+            last_full_cycle=int(cycle) if full else self.last_full_cycle,
+            contribution=[float(c) for c in contribution.max(axis=1)],
+        )
+        with open(os.path.join(self.directory, STATE_FILE + ".tmp"), "w") as f:
+            json.dump(self.state, f)
+        os.replace(os.path.join(self.directory, STATE_FILE + ".tmp"), os.path.join(self.directory, STATE_FILE))
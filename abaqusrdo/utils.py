@@ -1,16 +1,20 @@
-# Utils module for RDO that includes argument parser and
-# function to read name of objective function/dresps.
+# Utils module for RDO that includes argument parser,
+# function to read name of objective function/dresps and
+# function to write large tables in chunks.
 # --------------------------------------------------------------------#
 # Imports
 
 import sys
 import argparse
+import itertools
+import numpy as np
 
 
 # --------------------------------------------------------------------#
-def get_arguments():
+def get_arguments(argv=None):
     """Argument parser for rdo-workflow, arguments are optional so calling
-    program is flexible in which arguments to take.
+    program is flexible in which arguments to take. Parses argv if given,
+    otherwise the command line.
     """
     ap = argparse.ArgumentParser()
 
@@ -42,11 +46,18 @@ def get_arguments():
         help="Iteration of Tosca within Isight-loop, 0 being the reference-model.",
     )
 
-    args, _ = ap.parse_known_args(args=None if sys.argv[1:] else ["-h"])
+    if argv is None:
+        argv = sys.argv[1:] or ["-h"]
+    args, _ = ap.parse_known_args(args=argv)
 
     return args
 
 
+def get_jobs(job):
+    """Names of all FE models in job, e.g. "model_1,model_2" as passed for __FE_MODEL_LIST__."""
+    return [name for name in job.replace(",", " ").replace('"', " ").split() if name]
+
+
 def read_names(output_file):
     """This function takes the report file of a Tosca job and returns
     the name of the objective function and all constraints.
@@ -62,3 +73,16 @@ def read_names(output_file):
             name = name.split(":")[0]
             names.append(name)
     return names
+
+
+def write_rows(f, row_format, columns, chunk_size=100000):
+    """Write rows to open file f, formatting chunk_size rows at once.
+    Input:  row_format:   %-style format of a single row, e.g. "%d, %07E\n"
+            columns:      sequences/arrays of equal length, one per field of row_format
+    """
+    columns = [np.asarray(column) for column in columns]
+    number_of_rows = len(columns[0]) if columns else 0
+    for start in range(0, number_of_rows, chunk_size):
+        end = min(start + chunk_size, number_of_rows)
+        fields = zip(*[column[start:end].tolist() for column in columns])
+        f.write((row_format * (end - start)) % tuple(itertools.chain.from_iterable(fields)))
@@ -0,0 +1,203 @@
+# Module for the cleanup of cycle directories in <job>_RDO/inner_loop. Directories
+# of previous cycles are renamed into a trash directory, which is atomic and fast,
+# and deleted by a background thread while the current cycle is solved. Cycles
+# are retained according to a policy (last N cycles, every k-th cycle, failed
+# cycles) and a cap on the disk usage of the inner loop. Retained cycles may be
+# compressed into .tar.gz archives.
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import re
+import sys
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# --------------------------------------------------------------------#
+# Name of marker written to cycle directory after a successful cycle
+CYCLE_MARKER = "cycle_complete"
+
+TRASH_DIR = ".trash"
+ARCHIVE_EXTENSION = ".tar.gz"
+
+
+# --------------------------------------------------------------------#
+def get_size(path):
+    """Size of file or directory tree in bytes."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                continue
+    return size
+
+
+def mark_complete(cycle_dir):
+    """Mark cycle as successfully finished, cycles without marker are considered failed."""
+    with open(os.path.join(cycle_dir, CYCLE_MARKER), "w") as f:
+        f.write("{:f}\n".format(time.time()))
+
+
+def from_config(cfg, root_dir, job_name):
+    """Create collector from settings in config_rdo.py. By default (keep_last_cycles not
+    set or None), only the current cycle is kept, or all cycles in verbose mode.
+    keep_last_cycles = "all" keeps all cycles."""
+    keep_last = getattr(cfg, "keep_last_cycles", None)
+    if keep_last is None:
+        keep_last = None if cfg.verbose else 1
+    elif keep_last == "all":
+        keep_last = None
+    return WorkspaceCollector(
+        root_dir,
+        job_name,
+        keep_last,
+        getattr(cfg, "keep_every_cycle", None),
+        getattr(cfg, "keep_failed_cycles", True),
+        getattr(cfg, "max_inner_loop_size", None),
+        getattr(cfg, "archive_cycles", False),
+        cfg.verbose,
+    )
+
+
+class WorkspaceCollector(object):
+    """Removes and compresses directories of previous cycles <job>_XXX in root_dir.
+    Input:  keep_last:      number of most recent cycles incl. the current one to keep, None for all
+            keep_every:     keep every k-th cycle, None to disable
+            keep_failed:    keep cycles without completion marker
+            max_size:       max. disk usage of root_dir in bytes, oldest cycles are removed first
+            archive:        compress retained previous cycles into <job>_XXX.tar.gz
+    Cycles after the current cycle, e.g. from a previous optimization, are not touched.
+    """
+
+    def __init__(
+        self,
+        root_dir,
+        job_name,
+        keep_last=1,
+        keep_every=None,
+        keep_failed=True,
+        max_size=None,
+        archive=False,
+        verbose=False,
+    ):
+        self.root_dir = root_dir
+        self.job_name = job_name
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_failed = keep_failed
+        self.max_size = max_size
+        self.archive = archive
+        self.verbose = verbose
+        self.trash_dir = os.path.join(root_dir, TRASH_DIR)
+        self.pattern = re.compile(re.escape(job_name) + r"_(\d{3,})(" + re.escape(ARCHIVE_EXTENSION) + ")?$")
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+    def cycles(self):
+        """Return dict of cycle -> list of paths (directory and/or archive) in root dir."""
+        cycles = {}
+        if not os.path.isdir(self.root_dir):
+            return cycles
+        for name in sorted(os.listdir(self.root_dir)):
+            match = self.pattern.match(name)
+            if match:
+                cycles.setdefault(int(match.group(1)), []).append(os.path.join(self.root_dir, name))
+        return cycles
+
+    def is_failed(self, paths):
+        return any(os.path.isdir(path) and not os.path.exists(os.path.join(path, CYCLE_MARKER)) for path in paths)
+
+    def is_retained(self, cycle, current_cycle, paths):
+        """Retention policy for a previous cycle."""
+        if self.keep_last is None or cycle > current_cycle - self.keep_last:
+            return True
+        if self.keep_every and cycle % self.keep_every == 0:
+            return True
+        return self.keep_failed and self.is_failed(paths)
+
+    def collect(self, current_cycle):
+        """Apply retention policy to all previous cycles. Only renames happen here, deleting,
+        compressing and enforcing the disk-usage cap are done in the background."""
+        self._submit(self._empty_trash)
+        for cycle, paths in sorted(self.cycles().items()):
+            if cycle >= current_cycle:
+                continue
+            if not self.is_retained(cycle, current_cycle, paths):
+                for path in paths:
+                    self.remove(path)
+            elif self.archive:
+                for path in paths:
+                    if os.path.isdir(path):
+                        self._submit(self._compress, path)
+        if self.max_size is not None:
+            self._submit(self._enforce_max_size, current_cycle)
+
+    def remove(self, path):
+        """Move path into trash and delete it in the background."""
+        if not os.path.exists(self.trash_dir):
+            os.makedirs(self.trash_dir)
+        trash = os.path.join(self.trash_dir, "{}.{:d}.{:d}".format(os.path.basename(path), os.getpid(), time.time_ns()))
+        try:
+            os.rename(path, trash)
+        except OSError:  # removed concurrently
+            return
+        if self.verbose:
+            print("Removing {} in the background.".format(path))
+            sys.stdout.flush()
+        self._submit(self._delete, trash)
+
+    def wait(self):
+        """Wait for all background tasks, e.g. at the end of the cycle."""
+        while self.futures:  # tasks may submit further tasks
+            exception = self.futures.pop(0).exception()
+            if exception is not None:
+                print("Cleanup of inner loop failed: {}".format(exception))
+        sys.stdout.flush()
+
+    def _submit(self, function, *args):
+        self.futures.append(self.executor.submit(function, *args))
+
+    def _delete(self, path):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _empty_trash(self):
+        """Delete leftovers of interrupted cleanups."""
+        if os.path.isdir(self.trash_dir):
+            for name in os.listdir(self.trash_dir):
+                self._delete(os.path.join(self.trash_dir, name))
+
+    def _compress(self, path):
+        """Replace directory by archive, the directory is removed after the archive is complete."""
+        tmp_base = path + ".tmp"
+        shutil.make_archive(tmp_base, "gztar", root_dir=self.root_dir, base_dir=os.path.basename(path))
+        os.replace(tmp_base + ARCHIVE_EXTENSION, path + ARCHIVE_EXTENSION)
+        self.remove(path)
+        if self.verbose:
+            print("Compressed {} to {}.".format(path, path + ARCHIVE_EXTENSION))
+
+    def _enforce_max_size(self, current_cycle):
+        """Remove oldest previous cycles until the disk usage of root dir is below max_size."""
+        if not os.path.exists(self.trash_dir):
+            os.makedirs(self.trash_dir)
+        total = get_size(self.root_dir) - get_size(self.trash_dir)
+        for cycle, paths in sorted(self.cycles().items()):
+            if total <= self.max_size or cycle >= current_cycle:
+                break
+            for path in paths:
+                size = get_size(path)
+                trash = os.path.join(self.trash_dir, "{}.{:d}".format(os.path.basename(path), time.time_ns()))
+                try:
+                    os.rename(path, trash)
+                except OSError:
+                    continue
+                self._delete(trash)
+                total -= size
+            print("Removed cycle {} to limit disk usage of inner loop to {} bytes.".format(cycle, self.max_size))
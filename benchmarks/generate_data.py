@@ -0,0 +1,136 @@
+# Generator for synthetic results of the inner loop to benchmark the post-processing
+# without Abaqus/Tosca. Writes tosca/run_XXX/optimization_status_all.csv and
+# tosca/run_XXX/TP_SENS_000.onf as written by Tosca for every finite difference run.
+# The DRESPs depend linearly on the RVs, so derivatives are known exactly.
+#
+#   python generate_data.py -o <dir> -e 100000 -r 4 -d 3 --central
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "abaqusrdo"))
+import utils
+
+# Parameters of the data set written to the output dir, see load()
+METADATA_FILE = "data.json"
+
+
+# --------------------------------------------------------------------#
+def get_names(number_of_dresp):
+    """Names of DRESPs as in optimization_status_all.csv, first DRESP is the objective."""
+    names = ["[OBJ_FUNC]OBJ"]
+    names += ["[CON]CON_{:03d}:LE".format(i) for i in range(1, number_of_dresp)]
+    return names
+
+
+def get_rv_steps(number_of_rv, delta, use_central_differences):
+    """Perturbation of RVs for every run in the order of the run directories."""
+    steps = [np.zeros(number_of_rv)]
+    for i in range(number_of_rv):
+        if use_central_differences:
+            steps.append(-delta * np.identity(number_of_rv)[i])
+        steps.append(delta * np.identity(number_of_rv)[i])
+    return steps
+
+
+def write_run(run_dir, names, values, sensitivities, chunk_size=100000):
+    """Write status file and sensitivities of a single run."""
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    with open(os.path.join(run_dir, "optimization_status_all.csv"), "w") as f:
+        f.write("ITERATION," + ",".join(names) + ",VOLUME\n")
+        f.write("0," + ",".join(repr(float(v)) for v in values) + ",1.0\n")
+        f.write("1," + ",".join(repr(float(v)) for v in values) + ",1.0\n")
+
+    number_of_elements = sensitivities.shape[1]
+    ids = np.arange(1, number_of_elements + 1)
+    with open(os.path.join(run_dir, "TP_SENS_000.onf"), "w") as f:
+        f.write("# Tosca Structure ONF file\n   -1\n")
+        for name, sens in zip(names, sensitivities):
+            if "[OBJ_FUNC]" in name:
+                block = "OBJ_FUNC_SENSITIVITY"
+            else:
+                block = "CONSTRAINT_SENSITIVITY_" + name[5:].split(":")[0]
+            f.write("# Data block 642 - {}\n{:d}\n".format(block, number_of_elements))
+            utils.write_rows(f, "%d, %.7E\n", [ids, sens], chunk_size)
+            f.write("   -1\n")
+
+
+def generate(
+    output_dir,
+    number_of_elements=1000,
+    number_of_rv=2,
+    number_of_dresp=2,
+    use_central_differences=False,
+    delta=0.1,
+    seed=0,
+):
+    """Write synthetic results of all runs to <output_dir>/tosca/run_XXX.
+    Returns dict with the parameters of the data set, e.g. to create a config.
+    """
+    rng = np.random.default_rng(seed)
+    names = get_names(number_of_dresp)
+    base_values = 1 + rng.random(number_of_dresp)
+    value_gradient = rng.normal(size=(number_of_dresp, number_of_rv))
+    base_sens = rng.normal(size=(number_of_dresp, number_of_elements))
+    sens_gradient = rng.normal(size=(number_of_dresp, number_of_rv, 1)) * 0.1
+
+    tosca_dir = os.path.join(output_dir, "tosca")
+    metadata_file = os.path.join(output_dir, METADATA_FILE)
+    if os.path.exists(metadata_file):  # data set is incomplete while runs are written
+        os.remove(metadata_file)
+    for run, step in enumerate(get_rv_steps(number_of_rv, delta, use_central_differences)):
+        values = base_values + value_gradient.dot(step)
+        sensitivities = base_sens * (1 + np.tensordot(step, sens_gradient, axes=([0], [1])))
+        write_run(os.path.join(tosca_dir, "run_{:03d}".format(run)), names, values, sensitivities)
+
+    data = {
+        "number_of_elements": number_of_elements,
+        "number_of_rv": number_of_rv,
+        "number_of_dresp": number_of_dresp,
+        "use_central_differences": use_central_differences,
+        "delta": delta,
+        "seed": seed,
+    }
+    with open(metadata_file, "w") as f:
+        json.dump(data, f, indent=2)
+    return dict(data, tosca_dir=tosca_dir)
+
+
+def load(output_dir):
+    """Parameters of the data set in output_dir as returned by generate(), None if there is
+    no complete data set."""
+    metadata_file = os.path.join(output_dir, METADATA_FILE)
+    if not os.path.exists(metadata_file):
+        return None
+    with open(metadata_file, "r") as f:
+        data = json.load(f)
+    return dict(data, tosca_dir=os.path.join(output_dir, "tosca"))
+
+
+# --------------------------------------------------------------------#
+def get_arguments():
+    ap = argparse.ArgumentParser(description="Generate synthetic inner loop results.")
+    ap.add_argument("-o", "--output_dir", type=str, required=True, help="Directory to write tosca/run_XXX to")
+    ap.add_argument("-e", "--elements", type=int, default=1000, help="Number of elements/design variables")
+    ap.add_argument("-r", "--rvs", type=int, default=2, help="Number of random variables")
+    ap.add_argument("-d", "--dresps", type=int, default=2, help="Number of DRESPs incl. objective")
+    ap.add_argument("--central", action="store_true", help="Use central differences")
+    ap.add_argument("--delta", type=float, default=0.1, help="Finite difference step of RVs")
+    ap.add_argument("--seed", type=int, default=0, help="Seed of random data")
+    return ap.parse_args()
+
+
+def main():
+    args = get_arguments()
+    generate(args.output_dir, args.elements, args.rvs, args.dresps, args.central, args.delta, args.seed)
+    print("Generated synthetic results in {}".format(args.output_dir))
+
+
+if __name__ == "__main__":
+    main()
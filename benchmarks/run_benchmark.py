@@ -0,0 +1,227 @@
+# Benchmark of the post-processing in calculate_derivatives.main on synthetic data
+# from generate_data.py. Every stage is timed (wall and cpu time) and profiled for
+# memory (peak of traced allocations, max. resident set size). Results are written
+# as JSON, e.g. to compare stages between commits.
+#
+#   python run_benchmark.py -e 100000 -r 4 -d 3 --central -o results.json
+#   python run_benchmark.py -e 100000 -r 4 -d 3 --batch --workers 4
+# --------------------------------------------------------------------#
+# Imports
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "abaqusrdo"))
+import calculate_derivatives as cd
+import utils
+import generate_data
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+# --------------------------------------------------------------------#
+def get_max_rss():
+    """Max. resident set size of process in bytes, None if not available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_config(data, kappa=1.0, batch=False, workers=1):
+    """Config as in config_rdo.py for synthetic data set."""
+    n = data["number_of_rv"]
+    return types.SimpleNamespace(
+        number_of_rv=n,
+        mean_rv=n * [0.0],
+        sigma_rv=n * [1.0],
+        delta_rv=n * [data["delta"]],
+        use_central_differences=data["use_central_differences"],
+        kappa=kappa,
+        verbose=False,
+        batch_dresps=batch,
+        number_of_workers=workers,
+    )
+
+
+class Benchmark(object):
+    """Collects time and memory of stages."""
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def measure(self, stage, function, *args, **kwargs):
+        """Call function and record its wall time, cpu time and memory. Returns result of function.
+        Pass trace_memory=False to skip tracing allocations of the stage."""
+        trace_memory = kwargs.pop("trace_memory", self.trace_memory)
+        if trace_memory:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = function(*args, **kwargs)
+        record = {
+            "stage": stage,
+            "wall_time": time.perf_counter() - wall,
+            "cpu_time": time.process_time() - cpu,
+        }
+        if trace_memory:
+            record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        record["max_rss"] = get_max_rss()
+        self.records.append(record)
+        return result
+
+
+def run_stages(benchmark, data, cfg, result_dir):
+    """Run all stages of calculate_derivatives.main on data set."""
+    list_RV = cd.get_random_variables(cfg)
+    cov = benchmark.measure("get_covariance", cd.get_covariance, list_RV, False)
+    resultsDRESP, resultsSENS = benchmark.measure(
+        "get_results", cd.get_results, data["tosca_dir"], True, cfg.number_of_workers
+    )
+    names = [name for name in utils.read_names(resultsDRESP[0]) if "VOL" not in name if "MASS" not in name]
+
+    if cfg.batch_dresps:
+        batch = cd.DrespBatch(names, list_RV, cfg.number_of_workers)
+        benchmark.measure("find_values", batch.find_values, resultsDRESP)
+        benchmark.measure("find_sensitivities", batch.find_sensitivities, resultsSENS)
+        benchmark.measure("calculate", batch.calculate, cov, cfg.kappa)
+        list_DRESP = batch.to_dresps()
+    else:
+        list_DRESP = [cd.Dresp(name, list_RV) for name in names]
+
+        def for_all(method, *args):
+            for dresp in list_DRESP:
+                getattr(dresp, method)(*args)
+
+        benchmark.measure("find_values", for_all, "find_values", resultsDRESP)
+        benchmark.measure("find_sensitivities", for_all, "find_sensitivities", resultsSENS)
+        benchmark.measure("calculate_partial_derivatives", for_all, "calculate_partial_derivatives")
+        benchmark.measure("calculate_objective", for_all, "calculate_objective", cov, cfg.kappa)
+
+    def write_all():
+        for dresp in list_DRESP:
+            dresp.write_output(result_dir, [], cfg.use_central_differences, False)
+
+    benchmark.measure("write_output", write_all)
+
+
+def run(
+    data_dir=None,
+    number_of_elements=1000,
+    number_of_rv=2,
+    number_of_dresp=2,
+    use_central_differences=False,
+    batch=False,
+    workers=1,
+    repeat=1,
+    trace_memory=True,
+):
+    """Generate data and benchmark all stages repeat times. A data set in data_dir with the
+    same parameters, e.g. from a previous benchmark, is reused instead of generating it again.
+    Returns dict with parameters, environment and records of all stages.
+    """
+    keep_data = data_dir is not None
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix="rdo_benchmark_")
+    benchmark = Benchmark(trace_memory)
+    parameters = {
+        "number_of_elements": number_of_elements,
+        "number_of_rv": number_of_rv,
+        "number_of_dresp": number_of_dresp,
+        "use_central_differences": use_central_differences,
+    }
+    try:
+        data = generate_data.load(data_dir)
+        if data is None or any(data[key] != value for key, value in parameters.items()):
+            data = benchmark.measure(
+                "generate_data",
+                generate_data.generate,
+                data_dir,
+                number_of_elements,
+                number_of_rv,
+                number_of_dresp,
+                use_central_differences,
+                trace_memory=False,
+            )
+        else:
+            print("Reusing synthetic data in {}".format(data_dir), file=sys.stderr)
+        result_dir = os.path.join(data_dir, "sensitivities")
+        if not os.path.exists(result_dir):
+            os.makedirs(result_dir)
+        cfg = get_config(data, batch=batch, workers=workers)
+        for iteration in range(repeat):
+            start = len(benchmark.records)
+            run_stages(benchmark, data, cfg, result_dir)
+            for record in benchmark.records[start:]:
+                record["repeat"] = iteration
+    finally:
+        if not keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "parameters": dict(parameters, batch_dresps=batch, number_of_workers=workers),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": cd.np.__version__,
+            "platform": platform.platform(),
+        },
+        "records": benchmark.records,
+    }
+
+
+# --------------------------------------------------------------------#
+def get_arguments():
+    ap = argparse.ArgumentParser(description="Benchmark post-processing of inner loop on synthetic data.")
+    ap.add_argument("-e", "--elements", type=int, default=1000, help="Number of elements/design variables")
+    ap.add_argument("-r", "--rvs", type=int, default=2, help="Number of random variables")
+    ap.add_argument("-d", "--dresps", type=int, default=2, help="Number of DRESPs incl. objective")
+    ap.add_argument("--central", action="store_true", help="Use central differences")
+    ap.add_argument("--batch", action="store_true", help="Use batched evaluation of DRESPs")
+    ap.add_argument("--workers", type=int, default=1, help="Number of threads")
+    ap.add_argument("--repeat", type=int, default=1, help="Number of repetitions of all stages")
+    ap.add_argument(
+        "--data_dir",
+        type=str,
+        default=None,
+        help="Keep synthetic data in this directory, reused if generated with the same parameters",
+    )
+    ap.add_argument("--no_memory", action="store_true", help="Disable tracing of memory allocations")
+    ap.add_argument("-o", "--output", type=str, default=None, help="JSON file for results, default: stdout")
+    return ap.parse_args()
+
+
+def main():
+    args = get_arguments()
+    results = run(
+        args.data_dir,
+        args.elements,
+        args.rvs,
+        args.dresps,
+        args.central,
+        args.batch,
+        args.workers,
+        args.repeat,
+        not args.no_memory,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Saved benchmark results to {}".format(args.output))
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "abaqusrdo"))
+import inner_loop_service
+
+
+class InnerLoopServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.service = inner_loop_service.InnerLoopService(self.input_dir)
+        self.thread = threading.Thread(target=self.service.serve, daemon=True)
+        self.thread.start()
+        while not os.path.exists(inner_loop_service.get_address_file(self.input_dir)):
+            self.thread.join(0.01)
+
+    def tearDown(self):
+        conn = inner_loop_service.connect(self.input_dir)
+        if conn is not None:
+            inner_loop_service.request(conn, {"command": "stop"})
+        self.thread.join(5)
+
+    def test_wrong_key(self):
+        with self.assertRaises(AuthenticationError):
+            Client(self.service.listener.address, authkey=b"wrong key")
+        self.assertTrue(self.thread.is_alive())
+
+        conn = inner_loop_service.connect(self.input_dir)
+        self.assertIsNotNone(conn)
+        self.assertEqual(inner_loop_service.request(conn, {"command": "run"}), 2)  # malformed, but served
+        self.assertEqual(inner_loop_service.request(inner_loop_service.connect(self.input_dir), {"command": "stop"}), 0)
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(inner_loop_service.get_address_file(self.input_dir)))
+
+    def test_client_disconnect(self):
+        inner_loop_service.connect(self.input_dir).close()
+        conn = inner_loop_service.connect(self.input_dir)
+        self.assertIsNotNone(conn)
+        self.assertEqual(inner_loop_service.request(conn, ["not", "a", "request"]), 2)
+        self.assertTrue(self.thread.is_alive())
+
+    def test_working_dir_restored(self):
+        class Recorder(object):
+            def __init__(self):
+                self.messages = []
+
+            def send(self, message):
+                self.messages.append(message)
+
+        working_dir = os.getcwd()
+        self.service.run_cycle(Recorder(), ["-h"], tempfile.mkdtemp())
+        self.assertEqual(os.getcwd(), working_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()